@@ -0,0 +1,253 @@
+import json
+import os
+import re
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from database import init_db
+from auth import create_api_token, user_id_for_token
+import repos
+
+# API HTTP/JSON para ferramentas internas, rodando em paralelo ao Streamlit:
+#   python api.py   (API_HOST / API_PORT, padrão 127.0.0.1:8502)
+#
+#   POST /api/token                  {"username", "password"} -> {"token"}
+#   GET  /api/payments?month&year&page&page_size
+#   POST /api/payments               {"description", "amount", "due_date", ...}
+#   POST /api/payments/<id>/paid     {"paid": true, "version": 3}
+#   GET  /api/summary?month&year
+#
+# Demais rotas exigem "Authorization: Bearer <token>". Os GET respondem com
+# ETag formado pela versão dos dados do usuário e pelos parâmetros da
+# consulta (mês/ano, página), e aceitam If-None-Match (304).
+# "version" é sempre a versão da linha (a enviada em /paid); a versão dos
+# dados do usuário, base do ETag, vem em "data_version".
+API_HOST = os.environ.get("API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("API_PORT", "8502"))
+MAX_PAGE_SIZE = 500
+
+_PAID_ROUTE = re.compile(r"^/api/payments/(\d+)/paid$")
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def _int_param(query, name, default=None):
+    values = query.get(name)
+    if not values:
+        if default is None:
+            raise ApiError(400, f"Parâmetro obrigatório: {name}")
+        return default
+    try:
+        return int(values[0])
+    except ValueError:
+        raise ApiError(400, f"Parâmetro inválido: {name}")
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    server_version = "ControleFinanceiroAPI/1.0"
+
+    # ---------- helpers ----------
+    def _send_json(self, status, payload, etag=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "private, no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            data = json.loads(self.rfile.read(length))
+        except ValueError:
+            raise ApiError(400, "JSON inválido.")
+        if not isinstance(data, dict):
+            raise ApiError(400, "JSON inválido.")
+        return data
+
+    def _user_id(self):
+        header = self.headers.get("Authorization", "")
+        token = header[7:].strip() if header.startswith("Bearer ") else ""
+        user_id = user_id_for_token(token)
+        if not user_id:
+            raise ApiError(401, "Token ausente ou inválido.")
+        return user_id
+
+    def _etag(self, user_id, *parts):
+        """ETag da resposta: versão dos dados do usuário + parâmetros já validados."""
+        key = "-".join(str(p) for p in (user_id, repos.get_data_version(user_id), *parts))
+        return f'W/"{key}"'
+
+    def _not_modified(self, etag):
+        if etag in [t.strip() for t in self.headers.get("If-None-Match", "").split(",")]:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return True
+        return False
+
+    def _period(self, query):
+        today = date.today()
+        month = _int_param(query, "month", today.month)
+        year = _int_param(query, "year", today.year)
+        if not 1 <= month <= 12:
+            raise ApiError(400, "Parâmetro inválido: month")
+        return month, year
+
+    def _dispatch(self, routes):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        try:
+            for pattern, handler in routes:
+                match = pattern.match(url.path) if hasattr(pattern, "match") else None
+                if match or pattern == url.path:
+                    return handler(query, *(match.groups() if match else ()))
+            raise ApiError(404, "Rota não encontrada.")
+        except ApiError as e:
+            self._send_json(e.status, {"error": str(e)})
+        except repos.ConflictError as e:
+            self._send_json(409, {"error": str(e)})
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+        except Exception:
+            self._send_json(500, {"error": "Erro inesperado."})
+
+    def do_GET(self):
+        self._dispatch([
+            ("/api/payments", self._list_payments),
+            ("/api/summary", self._summary),
+        ])
+
+    def do_POST(self):
+        self._dispatch([
+            ("/api/token", self._token),
+            ("/api/payments", self._add_payment),
+            (_PAID_ROUTE, self._mark_paid),
+        ])
+
+    # ---------- rotas ----------
+    def _token(self, query):
+        data = self._read_json()
+        token = create_api_token(data.get("username", ""), data.get("password", ""))
+        if not token:
+            raise ApiError(401, "Usuário ou senha inválidos.")
+        self._send_json(201, {"token": token})
+
+    def _list_payments(self, query):
+        user_id = self._user_id()
+        month, year = self._period(query)
+        page = max(_int_param(query, "page", 1), 1)
+        page_size = min(max(_int_param(query, "page_size", 50), 1), MAX_PAGE_SIZE)
+
+        etag = self._etag(user_id, year, month, page, page_size)
+        if self._not_modified(etag):
+            return
+
+        rows, total = repos.list_payments_page(user_id, month, year, (page - 1) * page_size, page_size)
+        self._send_json(200, {
+            "month": month,
+            "year": year,
+            "page": page,
+            "page_size": page_size,
+            "total": total,
+            "items": [r._asdict() for r in rows],
+        }, etag=etag)
+
+    def _summary(self, query):
+        user_id = self._user_id()
+        month, year = self._period(query)
+
+        etag = self._etag(user_id, year, month)
+        if self._not_modified(etag):
+            return
+
+        totals = repos.month_totals(user_id, month, year)
+        budget = repos.get_budget(user_id, month, year)
+        self._send_json(200, {
+            "month": month,
+            "year": year,
+            **totals,
+            "income": budget["income"],
+            "expense_goal": budget["expense_goal"],
+            "balance": budget["income"] - totals["total"],
+        }, etag=etag)
+
+    def _add_payment(self, query):
+        user_id = self._user_id()
+        data = self._read_json()
+
+        try:
+            due = date.fromisoformat(str(data.get("due_date", "")))
+            amount = float(data.get("amount", 0))
+            installments = int(data.get("installments", 1))
+            category_id = data.get("category_id")
+            if category_id is not None:
+                category_id = int(category_id)
+        except (TypeError, ValueError):
+            raise ApiError(400, "Campos inválidos: amount, due_date, installments ou category_id.")
+
+        if category_id is not None and category_id not in {cid for cid, _ in repos.list_categories(user_id)}:
+            raise ApiError(400, "Categoria não encontrada.")
+
+        ids = repos.add_payment(
+            user_id,
+            data.get("description", ""),
+            amount,
+            due.isoformat(),
+            int(data.get("month", due.month)),
+            int(data.get("year", due.year)),
+            category_id,
+            is_credit=1 if installments > 1 else 0,
+            installments=installments,
+            currency=data.get("currency", "BRL")
+        )
+        self._send_json(201, {
+            "ok": True,
+            "ids": ids,
+            "version": 1,
+            "data_version": repos.get_data_version(user_id),
+        })
+
+    def _mark_paid(self, query, payment_id):
+        user_id = self._user_id()
+        data = self._read_json()
+        version = repos.mark_paid(
+            user_id,
+            int(payment_id),
+            bool(data.get("paid", True)),
+            expected_version=data.get("version")
+        )
+        if version is None:
+            raise ApiError(404, "Despesa não encontrada.")
+        self._send_json(200, {
+            "ok": True,
+            "id": int(payment_id),
+            "version": version,
+            "data_version": repos.get_data_version(user_id),
+        })
+
+
+def serve(host: str = API_HOST, port: int = API_PORT):
+    init_db()
+    httpd = ThreadingHTTPServer((host, port), ApiHandler)
+    print(f"API em http://{host}:{port}/api")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+
+if __name__ == "__main__":
+    serve()
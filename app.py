@@ -1,9 +1,8 @@
 import streamlit as st
-import pandas as pd
-import plotly.express as px
 from datetime import date, datetime
-import streamlit.components.v1 as components
 
+# plotly e streamlit.components são importados apenas nas telas que
+# os usam, para manter leve o carregamento inicial (tela de login).
 from database import init_db
 from auth import authenticate, create_user, get_security_question, reset_password
 import repos
@@ -31,6 +30,11 @@ MESES = [
 def fmt_brl(v):
     return f"R$ {v:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
 
+def fmt_money(v, currency, v_brl):
+    if currency == "BRL":
+        return fmt_brl(v)
+    return f"{currency} {v:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".") + f"  \n≈ {fmt_brl(v_brl)}"
+
 def format_date_br(s):
     if not s:
         return ""
@@ -42,13 +46,83 @@ def format_date_br(s):
 def is_admin():
     return st.session_state.username == ADMIN_USERNAME
 
+# ================= FILA DE ESCRITA =================
+WRITE_FLUSH_INTERVAL = 2.0
+
+def write_queue():
+    q = st.session_state.get("write_queue")
+    if q is None or q.user_id != st.session_state.user_id:
+        q = repos.WriteBehindQueue(st.session_state.user_id, WRITE_FLUSH_INTERVAL)
+        st.session_state.write_queue = q
+    return q
+
+def flush_pending_writes():
+    """Grava as marcações pendentes; conflitos viram aviso para o usuário."""
+    conflicts = write_queue().flush()
+    if conflicts:
+        st.session_state.msg_warn = (
+            f"{len(conflicts)} despesa(s) foram alteradas em outra sessão e não foram atualizadas."
+        )
+    return conflicts
+
+@st.fragment(run_every=WRITE_FLUSH_INTERVAL)
+def write_queue_flusher():
+    if write_queue().due() and flush_pending_writes():
+        st.rerun()
+
+# ================= DASHBOARD =================
+@st.cache_data(show_spinner=False, max_entries=64)
+def dashboard_figures(user_id, month, year, data_version):
+    """
+    Gera os gráficos do Dashboard a partir dos totais agregados no banco.
+    data_version (repos.get_data_version) entra na chave do cache: os
+    gráficos só são refeitos depois de alguma escrita do usuário.
+    """
+    import plotly.graph_objects as go
+
+    cat_rows = repos.category_totals(user_id, month, year)
+    budget = repos.get_budget(user_id, month, year)
+
+    labels = [name or "(Sem categoria)" for name, _, _ in cat_rows]
+    values = [float(total) for _, total, _ in cat_rows]
+    total = sum(values)
+    pago = sum(float(paid) for _, _, paid in cat_rows)
+
+    categories = go.Figure(go.Pie(labels=labels, values=values, hole=0.5))
+    categories.update_layout(title="Gastos por categoria")
+
+    status = go.Figure(go.Bar(
+        x=["Pago", "Em aberto"],
+        y=[pago, total - pago],
+        marker_color=["#22c55e", "#f59e0b"]
+    ))
+    status.update_layout(title="Pago x em aberto")
+
+    goal = None
+    meta = float(budget["expense_goal"])
+    if meta > 0:
+        goal = go.Figure(go.Indicator(
+            mode="gauge+number+delta",
+            value=total,
+            delta={"reference": meta, "increasing": {"color": "#ef4444"}},
+            gauge={
+                "axis": {"range": [0, max(meta, total) * 1.2]},
+                "threshold": {"line": {"color": "#ef4444", "width": 4}, "value": meta}
+            },
+            title={"text": "Gastos x meta do mês"}
+        ))
+
+    return {"categories": categories, "status": status, "goal": goal}
+
 # ================= SESSION =================
-for k in ["user_id", "username", "edit_id", "msg_ok"]:
+for k in ["user_id", "username", "edit_id", "msg_ok", "msg_warn"]:
     if k not in st.session_state:
         st.session_state[k] = None
 
 # ================= AUTH =================
 def screen_auth():
+    import streamlit.components.v1 as components
+
     st.title("💳 Controle Financeiro")
 
     components.html(
@@ -156,6 +230,7 @@ def screen_app():
             )
 
             if st.button("Sair", use_container_width=True):
+                flush_pending_writes()
                 st.session_state.user_id = None
                 st.session_state.username = None
                 st.rerun()
@@ -165,21 +240,28 @@ def screen_app():
             st.toast(st.session_state.msg_ok, icon="✅", duration=15)
             st.session_state.msg_ok = None
 
+        # Aviso de conflito de edição entre sessões
+        if st.session_state.msg_warn:
+            st.toast(st.session_state.msg_warn, icon="⚠️", duration=15)
+            st.session_state.msg_warn = None
+
+        # Alertas de orçamento gerados pelas últimas escritas
+        for alert in repos.pop_alerts(st.session_state.user_id):
+            st.toast(alert, icon="⚠️", duration=15)
+
         repos.seed_default_categories(st.session_state.user_id)
 
-        rows = repos.list_payments(st.session_state.user_id, month, year)
-        df = pd.DataFrame(
-            rows,
-            columns=[
-                "id", "Descrição", "Valor", "Vencimento", "Pago", "Data pagamento",
-                "CategoriaID", "Categoria", "is_credit", "installments",
-                "installment_index", "credit_group"
-            ]
-        )
+        # marcações de pago/em aberto são gravadas em lote pela fila
+        write_queue_flusher()
+        if write_queue().due():
+            flush_pending_writes()
+
+        rows = write_queue().apply(repos.list_payments(st.session_state.user_id, month, year))
+        totals = repos.payment_totals(rows)
 
-        total = df["Valor"].sum() if not df.empty else 0
-        pago = df[df["Pago"] == 1]["Valor"].sum() if not df.empty else 0
-        aberto = total - pago
+        total = totals["total"]
+        pago = totals["paid"]
+        aberto = totals["open"]
 
         budget = repos.get_budget(st.session_state.user_id, month, year)
         renda = float(budget["income"])
@@ -204,17 +286,43 @@ def screen_app():
             cat_map = {name: cid for cid, name in cats}
             cat_names = ["(Sem categoria)"] + list(cat_map.keys())
 
-            with st.expander("➕ Adicionar despesa", expanded=True):
-                with st.form("form_add_despesa", clear_on_submit=True):
-                    a1, a2, a3, a4, a5 = st.columns([3, 1, 1.3, 2, 1])
+            archived = repos.is_year_archived(st.session_state.user_id, year)
+            closed = repos.is_month_closed(st.session_state.user_id, month, year)
+            read_only = archived or closed
+
+            if archived:
+                st.info("📦 Ano arquivado: as despesas estão disponíveis somente para consulta.")
+            elif closed:
+                m1, m2 = st.columns([3, 1])
+                m1.info("🔒 Mês fechado: exibindo o extrato gravado no fechamento.")
+                if m2.button("🔓 Reabrir mês", key="reopen_month"):
+                    flush_pending_writes()
+                    repos.reopen_month(st.session_state.user_id, month, year)
+                    st.session_state.msg_ok = "Mês reaberto!"
+                    st.rerun()
+            elif st.button("🔒 Fechar mês", key="close_month"):
+                flush_pending_writes()
+                try:
+                    repos.close_month(st.session_state.user_id, month, year)
+                    st.session_state.msg_ok = "Mês fechado com sucesso!"
+                except ValueError as e:
+                    st.session_state.msg_warn = str(e)
+                st.rerun()
+
+            submitted = False
+            if not read_only:
+                with st.expander("➕ Adicionar despesa", expanded=True):
+                    with st.form("form_add_despesa", clear_on_submit=True):
+                        a1, a2, a6, a3, a4, a5 = st.columns([3, 1, 0.8, 1.3, 2, 1])
 
-                    desc = a1.text_input("Descrição")
-                    val = a2.number_input("Valor (R$)", min_value=0.0, step=10.0)
-                    venc = a3.date_input("Vencimento", value=date.today(), format="DD/MM/YYYY")
-                    cat_name = a4.selectbox("Categoria", cat_names)
-                    parcelas = a5.number_input("Parcelas", min_value=1, step=1, value=1)
+                        desc = a1.text_input("Descrição")
+                        val = a2.number_input("Valor", min_value=0.0, step=10.0)
+                        moeda = a6.selectbox("Moeda", repos.list_currencies())
+                        venc = a3.date_input("Vencimento", value=date.today(), format="DD/MM/YYYY")
+                        cat_name = a4.selectbox("Categoria", cat_names)
+                        parcelas = a5.number_input("Parcelas", min_value=1, step=1, value=1)
 
-                    submitted = st.form_submit_button("Adicionar")
+                        submitted = st.form_submit_button("Adicionar")
 
             if submitted:
                 if not desc.strip():
@@ -234,21 +342,24 @@ def screen_app():
                             year,
                             cid,
                             is_credit=1 if parcelas > 1 else 0,
-                            installments=int(parcelas)
+                            installments=int(parcelas),
+                            currency=moeda
                         )
 
                         st.session_state.msg_ok = "Despesa cadastrada com sucesso!"
                         st.rerun()
 
+                    except ValueError as e:
+                        st.error(str(e))
                     except Exception:
                         st.error("❌ Não foi possível cadastrar a despesa.")
 
             # -------- FATURA DO CARTÃO (PAGAR / DESFAZER) --------
             card_cat_ids = [cid for cid, name in cats if name and "cart" in str(name).lower()]
-            credit_rows = [r for r in rows if (r[6] in card_cat_ids)]
-            if credit_rows:
-                open_credit = [r for r in credit_rows if r[4] == 0]
-                total_fatura = sum(float(r[2]) for r in open_credit) if open_credit else 0.0
+            credit_rows = [r for r in rows if r.category_id in card_cat_ids]
+            if credit_rows and not read_only:
+                open_credit = [r for r in credit_rows if not r.paid]
+                total_fatura = sum(r.amount_brl for r in open_credit) if open_credit else 0.0
 
                 st.divider()
                 st.subheader("💳 Fatura do cartão")
@@ -258,18 +369,82 @@ def screen_app():
 
                 if open_credit:
                     if cB.button("💰 Pagar fatura do cartão", key="pay_card"):
+                        flush_pending_writes()
                         repos.mark_credit_invoice_paid(st.session_state.user_id, month, year)
                         st.session_state.msg_ok = "Fatura do cartão marcada como paga!"
                         st.rerun()
                 else:
                     if cB.button("🔄 Desfazer pagamento da fatura", key="unpay_card"):
+                        flush_pending_writes()
                         repos.unmark_credit_invoice_paid(st.session_state.user_id, month, year)
                         st.session_state.msg_ok = "Pagamento da fatura desfeito!"
                         st.rerun()
 
+            # -------- PARCELAMENTOS (GRUPO INTEIRO) --------
+            group_ids = sorted({r.credit_group for r in rows if r.credit_group and r.installments > 1})
+            if group_ids and not read_only:
+                st.divider()
+                st.subheader("📦 Parcelamentos")
+
+                for gid in group_ids:
+                    parcelas_g = repos.list_credit_group(st.session_state.user_id, gid)
+                    if not parcelas_g:
+                        continue
+
+                    first = parcelas_g[0]
+                    base_desc = first.description.rsplit(" (", 1)[0]
+                    em_aberto = [p for p in parcelas_g if not p.paid]
+
+                    with st.expander(
+                        f"{base_desc} — {len(parcelas_g)}x · "
+                        f"{len(em_aberto)} em aberto ({fmt_brl(sum(p.amount_brl for p in em_aberto))})"
+                    ):
+                        g1, g2 = st.columns(2)
+                        if em_aberto and g1.button("💰 Quitar parcelas restantes", key=f"prepay_{gid}"):
+                            flush_pending_writes()
+                            try:
+                                repos.prepay_credit_group(st.session_state.user_id, gid, month, year)
+                                st.session_state.msg_ok = "Parcelamento quitado!"
+                            except ValueError as e:
+                                st.session_state.msg_warn = str(e)
+                            st.rerun()
+
+                        if em_aberto and g2.button("🗑️ Cancelar parcelas em aberto", key=f"cancel_{gid}"):
+                            flush_pending_writes()
+                            repos.cancel_remaining_installments(st.session_state.user_id, gid)
+                            st.session_state.msg_ok = "Parcelas em aberto canceladas!"
+                            st.rerun()
+
+                        with st.form(f"group_form_{gid}", clear_on_submit=False):
+                            gcur_cat = first.category_name if first.category_name in cat_map else "(Sem categoria)"
+                            g_desc = st.text_input("Descrição", value=base_desc)
+                            g_cat = st.selectbox("Categoria", cat_names, index=cat_names.index(gcur_cat))
+                            g_val = st.number_input(
+                                "Valor das parcelas em aberto",
+                                value=float(em_aberto[0].amount if em_aberto else first.amount),
+                                step=10.0,
+                                disabled=not em_aberto
+                            )
+                            g_salvar = st.form_submit_button("Salvar parcelamento")
+
+                        if g_salvar:
+                            flush_pending_writes()
+                            try:
+                                repos.update_credit_group(
+                                    st.session_state.user_id,
+                                    gid,
+                                    g_desc,
+                                    None if g_cat == "(Sem categoria)" else cat_map[g_cat],
+                                    float(g_val) if em_aberto else None
+                                )
+                                st.session_state.msg_ok = "Parcelamento atualizado com sucesso!"
+                                st.rerun()
+                            except ValueError as e:
+                                st.error(str(e))
+
             st.divider()
 
-            if df.empty:
+            if not rows:
                 st.info("Nenhuma despesa cadastrada.")
             else:
                 for r in rows:
@@ -278,18 +453,21 @@ def screen_app():
                     a, b, c, d, e, f = st.columns([4, 1.2, 1.8, 1.2, 1.2, 1])
 
                     a.write(f"**{desc_r}**" + (f"  \n🏷️ {cat_name_r}" if cat_name_r else ""))
-                    b.write(fmt_brl(amount))
+                    b.write(fmt_money(amount, r.currency, r.amount_brl))
                     c.write(format_date_br(due))
                     d.write("✅ Paga" if paid else "🕓 Em aberto")
 
+                    if read_only:
+                        continue
+
                     if not paid:
                         if e.button("Marcar como paga", key=f"pay_{pid}"):
-                            repos.mark_paid(st.session_state.user_id, pid, True)
+                            write_queue().mark_paid(pid, True, r.version)
                             st.session_state.msg_ok = "Despesa marcada como paga!"
                             st.rerun()
                     else:
                         if e.button("Desfazer", key=f"unpay_{pid}"):
-                            repos.mark_paid(st.session_state.user_id, pid, False)
+                            write_queue().mark_paid(pid, False, r.version)
                             st.session_state.msg_ok = "Pagamento desfeito!"
                             st.rerun()
 
@@ -298,8 +476,12 @@ def screen_app():
                         st.rerun()
 
                     if f.button("Excluir", key=f"del_{pid}"):
-                        repos.delete_payment(st.session_state.user_id, pid)
-                        st.session_state.msg_ok = "Despesa excluída!"
+                        flush_pending_writes()
+                        try:
+                            repos.delete_payment(st.session_state.user_id, pid, r.version)
+                            st.session_state.msg_ok = "Despesa excluída!"
+                        except repos.ConflictError as e:
+                            st.session_state.msg_warn = str(e)
                         st.rerun()
 
                     if st.session_state.edit_id == pid:
@@ -327,16 +509,21 @@ def screen_app():
 
                         if salvar:
                             cid2 = None if n_cat_name == "(Sem categoria)" else cat_map2[n_cat_name]
-                            repos.update_payment(
-                                st.session_state.user_id,
-                                pid,
-                                n_desc,
-                                n_val,
-                                str(n_venc),
-                                cid2
-                            )
+                            flush_pending_writes()
+                            try:
+                                repos.update_payment(
+                                    st.session_state.user_id,
+                                    pid,
+                                    n_desc,
+                                    n_val,
+                                    str(n_venc),
+                                    cid2,
+                                    expected_version=r.version
+                                )
+                                st.session_state.msg_ok = "Despesa atualizada com sucesso!"
+                            except (repos.ConflictError, ValueError) as e:
+                                st.session_state.msg_warn = str(e)
                             st.session_state.edit_id = None
-                            st.session_state.msg_ok = "Despesa atualizada com sucesso!"
                             st.rerun()
 
                         if cancelar:
@@ -345,9 +532,19 @@ def screen_app():
 
         elif page == "📊 Dashboard":
             st.subheader("📊 Dashboard")
-            if not df.empty:
-                fig = px.pie(df, names="Categoria", values="Valor")
-                st.plotly_chart(fig, use_container_width=True)
+            if rows:
+                figs = dashboard_figures(
+                    st.session_state.user_id,
+                    month,
+                    year,
+                    repos.get_data_version(st.session_state.user_id)
+                )
+
+                g1, g2 = st.columns(2)
+                g1.plotly_chart(figs["categories"], use_container_width=True)
+                g2.plotly_chart(figs["status"], use_container_width=True)
+                if figs["goal"] is not None:
+                    st.plotly_chart(figs["goal"], use_container_width=True)
 
         elif page == "🏷️ Categorias":
             st.subheader("🏷️ Categorias")
@@ -373,6 +570,7 @@ def screen_app():
                 a, b = st.columns([4, 1])
                 a.write(name)
                 if b.button("Excluir", key=f"cat_{cid}"):
+                    flush_pending_writes()
                     repos.delete_category(st.session_state.user_id, cid)
                     st.session_state.msg_ok = "Categoria excluída!"
                     st.rerun()
@@ -386,6 +584,109 @@ def screen_app():
                 st.session_state.msg_ok = "Planejamento salvo com sucesso!"
                 st.rerun()
 
+            st.divider()
+            st.markdown("**📈 Projeção de saldo**")
+            horizon = st.radio("Horizonte", [12, 24], horizontal=True, format_func=lambda n: f"{n} meses")
+
+            import forecast
+            import plotly.graph_objects as go
+
+            proj = forecast.project_balance(st.session_state.user_id, month, year, horizon)
+            labels = [f"{MESES[m - 1][:3]}/{y}" for m, y in zip(proj["month"], proj["year"])]
+
+            fig = go.Figure()
+            fig.add_bar(x=labels, y=proj["income"], name="Renda", marker_color="#22c55e")
+            fig.add_bar(x=labels, y=proj["expenses"], name="Despesas lançadas", marker_color="#ef4444")
+            fig.add_scatter(x=labels, y=proj["balance"], name="Saldo acumulado", mode="lines+markers")
+            fig.update_layout(barmode="group")
+            st.plotly_chart(fig, use_container_width=True)
+
+            p1, p2 = st.columns(2)
+            p1.metric("Parcelas em aberto no período", fmt_brl(float(proj["open"].sum())))
+            p2.metric(f"Saldo projetado em {labels[-1]}", fmt_brl(float(proj["balance"][-1])))
+
+            st.divider()
+            st.markdown("**🚨 Limites por categoria**")
+            st.caption("Você recebe um alerta ao atingir 80% e 100% da meta do mês ou do limite da categoria.")
+
+            cats = repos.list_categories(st.session_state.user_id)
+            limits = repos.list_category_limits(st.session_state.user_id)
+            cat_by_name = {name: cid for cid, name in cats}
+
+            with st.form("form_limite", clear_on_submit=True):
+                l1, l2 = st.columns([3, 1])
+                lim_cat = l1.selectbox("Categoria", list(cat_by_name.keys()))
+                lim_val = l2.number_input("Limite mensal (R$)", min_value=0.0, step=50.0)
+                submitted_lim = st.form_submit_button("Salvar limite")
+
+            if submitted_lim and lim_cat:
+                repos.set_category_limit(st.session_state.user_id, cat_by_name[lim_cat], float(lim_val))
+                st.session_state.msg_ok = "Limite salvo com sucesso!"
+                st.rerun()
+
+            for cid, name in cats:
+                if cid in limits:
+                    st.write(f"{name}: {fmt_brl(limits[cid])}")
+
+            # cotações são compartilhadas entre todos os usuários
+            if is_admin():
+                st.divider()
+                st.markdown("**💱 Cotações**")
+                st.caption("CSV com cabeçalho currency,date,rate — valor de 1 unidade da moeda em reais (ex.: USD,2024-03-01,4.97).")
+                fx_file = st.file_uploader("Arquivo de cotações", type=["csv"], key="fx_file")
+                if fx_file is not None and st.button("Carregar cotações", key="btn_fx"):
+                    try:
+                        n = repos.load_fx_rates_csv(fx_file.getvalue())
+                        st.session_state.msg_ok = f"{n} cotações carregadas!"
+                        st.rerun()
+                    except (ValueError, KeyError):
+                        st.error("❌ Arquivo de cotações inválido.")
+
+            st.divider()
+            st.markdown("**💾 Backup**")
+
+            import backup
+            import io
+
+            b1, b2 = st.columns(2)
+            if b1.button("Gerar backup", key="btn_backup"):
+                buf = io.StringIO()
+                backup.export_user_ndjson(st.session_state.user_id, buf)
+                st.session_state.backup_bytes = buf.getvalue().encode("utf-8")
+            if st.session_state.get("backup_bytes"):
+                b2.download_button(
+                    "⬇️ Baixar backup",
+                    st.session_state.backup_bytes,
+                    file_name=f"backup_{st.session_state.username}_{date.today().isoformat()}.ndjson",
+                    mime="application/x-ndjson"
+                )
+
+            restore_file = st.file_uploader("Restaurar backup (.ndjson)", type=["ndjson", "jsonl"], key="restore_file")
+            if restore_file is not None:
+                st.warning("A restauração substitui todas as suas despesas, categorias e planejamentos.")
+                if st.button("Restaurar", key="btn_restore"):
+                    flush_pending_writes()
+                    try:
+                        n = backup.restore_user_ndjson(st.session_state.user_id, restore_file.getvalue())
+                        st.session_state.backup_bytes = None
+                        st.session_state.msg_ok = f"Backup restaurado ({n} registros)!"
+                        st.rerun()
+                    except (ValueError, KeyError):
+                        st.error("❌ Arquivo de backup inválido.")
+
+            st.divider()
+            st.markdown("**📦 Arquivo**")
+            archived_years = repos.list_archived_years(st.session_state.user_id)
+            if archived_years:
+                st.caption("Anos arquivados: " + ", ".join(str(y) for y in archived_years))
+            if st.button("Arquivar anos encerrados", key="btn_archive"):
+                moved = repos.archive_closed_years(st.session_state.user_id)
+                if moved:
+                    st.session_state.msg_ok = "Anos arquivados: " + ", ".join(str(y) for y in moved)
+                else:
+                    st.session_state.msg_ok = "Nenhum ano encerrado para arquivar."
+                st.rerun()
+
     except Exception:
         st.error("❌ Ocorreu um erro inesperado. Tente novamente.")
         st.stop()
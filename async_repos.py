@@ -0,0 +1,86 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import auth
+import repos
+
+# Fachada asyncio para repos.py e auth.py, para uso fora do Streamlit
+# (jobs em lote, APIs). Cada chamada roda numa thread do executor, que abre
+# e fecha a própria conexão como as funções síncronas, sem bloquear o loop.
+ASYNC_WORKERS = int(os.environ.get("REPOS_ASYNC_WORKERS", "4"))
+
+_executor = ThreadPoolExecutor(max_workers=ASYNC_WORKERS, thread_name_prefix="repos")
+
+def _to_async(fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+    return wrapper
+
+def shutdown(wait: bool = True):
+    _executor.shutdown(wait=wait)
+
+# -------------------- Auth --------------------
+create_user = _to_async(auth.create_user)
+authenticate = _to_async(auth.authenticate)
+get_security_question = _to_async(auth.get_security_question)
+reset_password = _to_async(auth.reset_password)
+
+# -------------------- Categories --------------------
+list_categories = _to_async(repos.list_categories)
+create_category = _to_async(repos.create_category)
+delete_category = _to_async(repos.delete_category)
+seed_default_categories = _to_async(repos.seed_default_categories)
+
+# -------------------- Payments / Despesas --------------------
+add_payment = _to_async(repos.add_payment)
+list_payments = _to_async(repos.list_payments)
+list_payments_page = _to_async(repos.list_payments_page)
+month_totals = _to_async(repos.month_totals)
+category_totals = _to_async(repos.category_totals)
+mark_paid = _to_async(repos.mark_paid)
+delete_payment = _to_async(repos.delete_payment)
+update_payment = _to_async(repos.update_payment)
+mark_credit_invoice_paid = _to_async(repos.mark_credit_invoice_paid)
+unmark_credit_invoice_paid = _to_async(repos.unmark_credit_invoice_paid)
+merge_credit_group = _to_async(repos.merge_credit_group)
+list_credit_group = _to_async(repos.list_credit_group)
+update_credit_group = _to_async(repos.update_credit_group)
+cancel_remaining_installments = _to_async(repos.cancel_remaining_installments)
+prepay_credit_group = _to_async(repos.prepay_credit_group)
+
+# -------------------- Budget / Alertas --------------------
+get_budget = _to_async(repos.get_budget)
+upsert_budget = _to_async(repos.upsert_budget)
+list_category_limits = _to_async(repos.list_category_limits)
+set_category_limit = _to_async(repos.set_category_limit)
+pop_alerts = _to_async(repos.pop_alerts)
+
+# -------------------- Câmbio / Arquivo / Versão --------------------
+list_currencies = _to_async(repos.list_currencies)
+load_fx_rates = _to_async(repos.load_fx_rates)
+is_year_archived = _to_async(repos.is_year_archived)
+list_archived_years = _to_async(repos.list_archived_years)
+archive_closed_years = _to_async(repos.archive_closed_years)
+get_data_version = _to_async(repos.get_data_version)
+
+# -------------------- Página --------------------
+async def load_page(user_id: int, month: int, year: int):
+    """
+    Busca em paralelo o que a tela de despesas precisa: despesas do mês,
+    orçamento e categorias.
+    """
+    payments, budget, categories = await asyncio.gather(
+        list_payments(user_id, month, year),
+        get_budget(user_id, month, year),
+        list_categories(user_id),
+    )
+    return {
+        "payments": payments,
+        "totals": repos.payment_totals(payments),
+        "budget": budget,
+        "categories": categories,
+    }
@@ -1,6 +1,8 @@
 import bcrypt
 import datetime
-from database import get_connection
+import hashlib
+import secrets
+from database import get_connection, get_write_connection, begin_write
 
 
 def _now():
@@ -27,26 +29,32 @@ def create_user(username, password, security_question, security_answer):
     if len(password) < 4:
         raise ValueError("Senha muito curta (mínimo 4).")
 
-    conn = get_connection()
-    cur = conn.cursor()
-
-    cur.execute(
-        """
-        INSERT INTO users
-            (username, password_hash, security_question, security_answer_hash, created_at)
-        VALUES (?, ?, ?, ?, ?)
-        """,
-        (
-            username,
-            hash_text(password),
-            security_question.strip(),
-            hash_text(security_answer.strip()),
-            _now()
+    # hashes antes de abrir a transação: o bcrypt não segura o lock de escrita
+    password_hash = hash_text(password)
+    answer_hash = hash_text(security_answer.strip())
+
+    conn = get_write_connection()
+    try:
+        cur = conn.cursor()
+
+        cur.execute(
+            """
+            INSERT INTO users
+                (username, password_hash, security_question, security_answer_hash, created_at)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (
+                username,
+                password_hash,
+                security_question.strip(),
+                answer_hash,
+                _now()
+            )
         )
-    )
 
-    conn.commit()
-    conn.close()
+        conn.commit()
+    finally:
+        conn.close()
 
 
 # -------------------- AUTHENTICATE --------------------
@@ -113,11 +121,61 @@ def reset_password(username: str, security_answer: str, new_password: str) -> bo
         conn.close()
         return False
 
+    password_hash = hash_text(new_password)
+    begin_write(conn)
     cur.execute(
         "UPDATE users SET password_hash = ? WHERE id = ?",
-        (hash_text(new_password), user_id)
+        (password_hash, user_id)
     )
 
     conn.commit()
     conn.close()
     return True
+
+
+# -------------------- API TOKENS --------------------
+def _token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def create_api_token(username: str, password: str):
+    """Autentica e gera um token para a API. Retorna None se as credenciais forem inválidas."""
+    user_id = authenticate(username or "", password or "")
+    if not user_id:
+        return None
+
+    token = secrets.token_urlsafe(32)
+
+    conn = get_write_connection()
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT INTO api_tokens (token_hash, user_id, created_at) VALUES (?, ?, ?)",
+        (_token_hash(token), user_id, _now())
+    )
+    conn.commit()
+    conn.close()
+    return token
+
+
+def user_id_for_token(token: str):
+    if not token:
+        return None
+
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT user_id FROM api_tokens WHERE token_hash = ?",
+        (_token_hash(token),)
+    )
+    row = cur.fetchone()
+    conn.close()
+
+    return row[0] if row else None
+
+
+def revoke_api_token(token: str):
+    conn = get_write_connection()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM api_tokens WHERE token_hash = ?", (_token_hash(token),))
+    conn.commit()
+    conn.close()
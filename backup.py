@@ -0,0 +1,295 @@
+import argparse
+import datetime
+import io
+import json
+import os
+import sqlite3
+
+from database import get_connection, begin_write, is_postgres, archive_path, attach_archive, table_columns
+import repos
+
+# Backup e restauração por usuário, em NDJSON (uma linha de cabeçalho por
+# tabela seguida de uma linha JSON por registro) ou num arquivo SQLite
+# próprio do usuário, gravado com a API de backup do sqlite3.
+BACKUP_FORMAT = "controle-financeiro-backup"
+BACKUP_VERSION = 1
+BATCH_SIZE = 5000
+
+# Ordem importa na restauração: categorias antes de despesas e limites.
+# fx_rates é compartilhada entre usuários e fica fora do backup: restaurar
+# cotações de um usuário mudaria a conversão das despesas dos outros.
+USER_TABLES = ["categories", "payments", "budgets", "category_limits", "month_snapshots"]
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+def _iter_cursor(cur, batch_size: int = BATCH_SIZE):
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        yield from rows
+
+def _has_archive(user_id: int) -> bool:
+    return not is_postgres() and os.path.exists(archive_path(user_id))
+
+# -------------------- Export --------------------
+def _iter_sections(conn, user_id: int):
+    """Gera (tabela, colunas, linhas) com os dados do usuário, lidos em lotes."""
+    cur = conn.cursor()
+    for table in USER_TABLES:
+        cur.execute(f"SELECT * FROM {table} WHERE user_id = ?", (user_id,))
+        yield table, [d[0] for d in cur.description], _iter_cursor(cur)
+
+    if _has_archive(user_id):
+        attach_archive(conn, user_id)
+        cols = ", ".join(sorted(table_columns(cur, "payments")))
+        cur.execute(f"SELECT {cols} FROM archive.payments WHERE user_id = ?", (user_id,))
+        yield "payments", [d[0] for d in cur.description], _iter_cursor(cur)
+
+def export_user_ndjson(user_id: int, f):
+    """Grava o backup do usuário em NDJSON no arquivo texto f. Retorna o nº de registros."""
+    conn = get_connection()
+    count = 0
+    try:
+        f.write(json.dumps({
+            "format": BACKUP_FORMAT,
+            "version": BACKUP_VERSION,
+            "user_id": user_id,
+            "exported_at": _now(),
+        }) + "\n")
+        for table, cols, rows in _iter_sections(conn, user_id):
+            f.write(json.dumps({"table": table, "columns": cols}) + "\n")
+            for row in rows:
+                f.write(json.dumps(list(row), ensure_ascii=False, separators=(",", ":")) + "\n")
+                count += 1
+    finally:
+        conn.close()
+    return count
+
+def export_user_sqlite(user_id: int, path: str):
+    """
+    Grava o backup do usuário num arquivo SQLite: monta o banco em memória
+    e copia para path com Connection.backup. Retorna o nº de registros.
+    """
+    src = get_connection()
+    mem = sqlite3.connect(":memory:")
+    count = 0
+    try:
+        for table, cols, rows in _iter_sections(src, user_id):
+            mem.execute(f"CREATE TABLE IF NOT EXISTS {table} ({', '.join(cols)})")
+            insert = f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' for _ in cols)})"
+            batch = []
+            for row in rows:
+                batch.append(tuple(row))
+                if len(batch) >= BATCH_SIZE:
+                    mem.executemany(insert, batch)
+                    count += len(batch)
+                    batch = []
+            mem.executemany(insert, batch)
+            count += len(batch)
+
+        mem.execute("CREATE TABLE backup_info (key TEXT PRIMARY KEY, value TEXT)")
+        mem.executemany(
+            "INSERT INTO backup_info (key, value) VALUES (?, ?)",
+            [
+                ("format", BACKUP_FORMAT),
+                ("version", str(BACKUP_VERSION)),
+                ("user_id", str(user_id)),
+                ("exported_at", _now()),
+            ]
+        )
+        mem.commit()
+
+        dst = sqlite3.connect(path)
+        mem.backup(dst)
+        dst.close()
+    finally:
+        mem.close()
+        src.close()
+    return count
+
+# -------------------- Restore --------------------
+def _iter_ndjson(f):
+    header = json.loads(f.readline() or "{}")
+    if header.get("format") != BACKUP_FORMAT:
+        raise ValueError("Arquivo de backup inválido.")
+
+    table, cols = None, None
+    for line in f:
+        line = line.strip()
+        if not line:
+            continue
+        item = json.loads(line)
+        if isinstance(item, dict):
+            table, cols = item["table"], item["columns"]
+        elif table is None:
+            raise ValueError("Arquivo de backup inválido.")
+        else:
+            yield table, cols, item
+
+def _iter_sqlite(path: str):
+    if not os.path.exists(path):
+        raise ValueError("Arquivo de backup não encontrado.")
+    src = sqlite3.connect(path)
+    try:
+        tables = {r[0] for r in src.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if "backup_info" not in tables:
+            raise ValueError("Arquivo de backup inválido.")
+        for table in USER_TABLES:
+            if table not in tables:
+                continue
+            cur = src.execute(f"SELECT * FROM {table}")
+            cols = [d[0] for d in cur.description]
+            for row in _iter_cursor(cur):
+                yield table, cols, row
+    finally:
+        src.close()
+
+def _restore(user_id: int, records, batch_size: int = BATCH_SIZE):
+    """
+    Substitui os dados do usuário pelos registros (tabela, colunas, linha)
+    numa única transação, com inserções em lote. Ids de categorias e grupos
+    de parcelamento são renumerados; os contadores de gastos são refeitos e
+    os meses fechados são fechados de novo sobre as despesas restauradas
+    (os snapshots do backup guardam os ids antigos).
+    """
+    conn = get_connection()
+    has_archive = _has_archive(user_id)
+    if has_archive:
+        attach_archive(conn, user_id)
+    begin_write(conn)
+    cur = conn.cursor()
+
+    try:
+        for table in USER_TABLES + ["spend_counters", "archived_years"]:
+            cur.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+        if has_archive:
+            cur.execute("DELETE FROM archive.payments WHERE user_id = ?", (user_id,))
+
+        cur.execute("SELECT COALESCE(MAX(credit_group), 0) FROM payments")
+        group_base = cur.fetchone()[0]
+
+        old_cat_names = {}
+        closed_months = []
+        cat_map = None
+        target_cols = {}
+        count = 0
+
+        section = None
+        batch = []
+        insert = None
+
+        def flush():
+            nonlocal batch, count
+            if batch:
+                cur.executemany(insert, batch)
+                count += len(batch)
+                batch = []
+
+        for table, cols, row in records:
+            if table not in USER_TABLES:
+                continue
+
+            if section != (table, tuple(cols)):
+                flush()
+                section = (table, tuple(cols))
+
+                if table != "categories" and cat_map is None:
+                    cur.execute("SELECT id, name FROM categories WHERE user_id = ?", (user_id,))
+                    new_ids = {name: cid for cid, name in cur.fetchall()}
+                    cat_map = {old: new_ids.get(name) for old, name in old_cat_names.items()}
+
+                if table not in target_cols:
+                    target_cols[table] = table_columns(cur, table)
+                keep = [i for i, c in enumerate(cols) if c != "id" and c in target_cols[table]]
+                names = [cols[i] for i in keep]
+                pos = {c: n for n, c in enumerate(names)}
+
+                insert = (
+                    f"INSERT INTO {table} ({', '.join(names)}) "
+                    f"VALUES ({', '.join('?' for _ in names)})"
+                )
+                id_idx = cols.index("id") if "id" in cols else None
+
+            values = [row[i] for i in keep]
+            if "user_id" in pos:
+                values[pos["user_id"]] = user_id
+
+            if table == "month_snapshots":
+                closed_months.append((values[pos["month"]], values[pos["year"]], values[pos["closed_at"]]))
+                continue
+            if table == "categories":
+                if id_idx is not None:
+                    old_cat_names[row[id_idx]] = values[pos["name"]]
+            elif table in ("payments", "category_limits") and "category_id" in pos:
+                old_cat = values[pos["category_id"]]
+                values[pos["category_id"]] = cat_map.get(old_cat) if old_cat is not None else None
+                if table == "category_limits" and values[pos["category_id"]] is None:
+                    continue
+            if table == "payments" and "credit_group" in pos and values[pos["credit_group"]] is not None:
+                values[pos["credit_group"]] += group_base
+
+            batch.append(values)
+            if len(batch) >= batch_size:
+                flush()
+
+        flush()
+
+        cur.execute(
+            f"""INSERT INTO spend_counters (user_id, month, year, category_id, total)
+                SELECT p.user_id, p.month, p.year, COALESCE(p.category_id, 0), SUM({repos.AMOUNT_BRL_SQL})
+                FROM payments p
+                WHERE p.user_id = ?
+                GROUP BY p.user_id, p.month, p.year, COALESCE(p.category_id, 0)""",
+            (user_id,)
+        )
+        for month, year, closed_at in closed_months:
+            repos._write_month_snapshot(conn, user_id, month, year, closed_at)
+        count += len(closed_months)
+        repos._bump_version(cur, user_id)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return count
+
+def restore_user_ndjson(user_id: int, f, batch_size: int = BATCH_SIZE):
+    """Restaura o backup NDJSON (arquivo texto ou bytes) sobre os dados do usuário."""
+    if isinstance(f, (bytes, bytearray)):
+        f = io.StringIO(f.decode("utf-8"))
+    return _restore(user_id, _iter_ndjson(f), batch_size)
+
+def restore_user_sqlite(user_id: int, path: str, batch_size: int = BATCH_SIZE):
+    """Restaura um backup gerado por export_user_sqlite sobre os dados do usuário."""
+    return _restore(user_id, _iter_sqlite(path), batch_size)
+
+# -------------------- CLI --------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backup por usuário (.ndjson ou .db)")
+    parser.add_argument("action", choices=["export", "restore"])
+    parser.add_argument("user_id", type=int)
+    parser.add_argument("path")
+    args = parser.parse_args(argv)
+
+    as_sqlite = args.path.endswith((".db", ".sqlite", ".sqlite3"))
+    if args.action == "export":
+        if as_sqlite:
+            n = export_user_sqlite(args.user_id, args.path)
+        else:
+            with open(args.path, "w", encoding="utf-8") as f:
+                n = export_user_ndjson(args.user_id, f)
+        print(f"{n} registros exportados para {args.path}")
+    else:
+        if as_sqlite:
+            n = restore_user_sqlite(args.user_id, args.path)
+        else:
+            with open(args.path, "r", encoding="utf-8") as f:
+                n = restore_user_ndjson(args.user_id, f)
+        print(f"{n} registros restaurados de {args.path}")
+
+if __name__ == "__main__":
+    main()
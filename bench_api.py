@@ -0,0 +1,169 @@
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, defaultdict
+from datetime import date
+
+# Teste de carga da API (api.py):
+#   python bench_api.py
+#       sobe a API numa porta livre, com banco temporário e um usuário com
+#       --payments despesas no mês atual, e dispara --clients clientes por
+#       --seconds segundos (servidor e clientes no mesmo processo).
+#   python bench_api.py --url http://127.0.0.1:8502 --username u --password p
+#       contra uma instância local já rodando (python api.py).
+#
+# Mistura: listagem paginada (metade com If-None-Match), resumo do mês e
+# marcação de pago com a versão da linha. Relata req/s, latências por rota
+# e contagem de status; sai com erro se houver resposta 5xx.
+
+
+def _request(url, method="GET", token=None, body=None, etag=None):
+    req = urllib.request.Request(url, method=method)
+    if token:
+        req.add_header("Authorization", f"Bearer {token}")
+    if etag:
+        req.add_header("If-None-Match", etag)
+    data = None
+    if body is not None:
+        data = json.dumps(body).encode("utf-8")
+        req.add_header("Content-Type", "application/json")
+    try:
+        with urllib.request.urlopen(req, data=data, timeout=30) as resp:
+            raw = resp.read()
+            return resp.status, resp.headers.get("ETag"), json.loads(raw) if raw else None
+    except urllib.error.HTTPError as e:
+        raw = e.read()
+        return e.code, e.headers.get("ETag"), json.loads(raw) if raw else None
+
+
+def _local_instance(n_payments):
+    """Banco temporário + API numa thread. Retorna (url, usuário, senha, server)."""
+    import database
+
+    tmp = tempfile.mkdtemp(prefix="bench_api_")
+    database.DB_PATH = os.path.join(tmp, "database.db")
+    database.ARCHIVE_DIR = os.path.join(tmp, "archive")
+
+    from http.server import ThreadingHTTPServer
+    from api import ApiHandler
+    from auth import create_user, authenticate
+    import repos
+
+    database.init_db()
+    create_user("bench", "bench123", "q", "a")
+    user_id = authenticate("bench", "bench123")
+
+    today = date.today()
+    for i in range(n_payments):
+        repos.add_payment(
+            user_id, f"Despesa {i}", 10 + i % 90, today.replace(day=1 + i % 28).isoformat(),
+            today.month, today.year
+        )
+
+    ApiHandler.log_message = lambda *args: None
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ApiHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", "bench", "bench123", server
+
+
+def run(url, token, clients, seconds, page_size):
+    stats = defaultdict(list)
+    statuses = Counter()
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    status, _, first = _request(f"{url}/api/payments?page_size={page_size}", token=token)
+    if status != 200 or not first["items"]:
+        raise SystemExit(f"listagem inicial falhou ({status}): {first}")
+
+    def client(seed):
+        rnd = random.Random(seed)
+        etag = None
+        items = first["items"]
+        while time.perf_counter() < deadline:
+            roll = rnd.random()
+            t0 = time.perf_counter()
+            if roll < 0.6:
+                route = "GET /api/payments"
+                status, new_etag, body = _request(
+                    f"{url}/api/payments?page_size={page_size}",
+                    token=token,
+                    etag=etag if rnd.random() < 0.5 else None
+                )
+                if status == 200:
+                    etag, items = new_etag, body["items"]
+            elif roll < 0.8:
+                route = "GET /api/summary"
+                status, _, _ = _request(f"{url}/api/summary", token=token)
+            else:
+                route = "POST /paid"
+                item = rnd.choice(items)
+                status, _, body = _request(
+                    f"{url}/api/payments/{item['id']}/paid",
+                    method="POST",
+                    token=token,
+                    body={"paid": not item["paid"], "version": item["version"]}
+                )
+            elapsed = time.perf_counter() - t0
+            with lock:
+                stats[route].append(elapsed)
+                statuses[status] += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    total_time = time.perf_counter() - t0
+
+    total = sum(statuses.values())
+    print(f"{clients} clientes, {total_time:.1f}s: {total} requisições, {total / total_time:.0f} req/s")
+    for route, times in sorted(stats.items()):
+        times.sort()
+        pct = lambda q: times[min(int(q * len(times)), len(times) - 1)] * 1000
+        print(f"  {route:<20} n={len(times):<6} p50={pct(0.5):6.1f}ms  p95={pct(0.95):6.1f}ms  p99={pct(0.99):6.1f}ms")
+    print("  status: " + ", ".join(f"{code}={n}" for code, n in sorted(statuses.items())))
+    return statuses
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Teste de carga da API HTTP")
+    parser.add_argument("--url", help="instância já rodando (padrão: sobe uma local)")
+    parser.add_argument("--username")
+    parser.add_argument("--password")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--payments", type=int, default=200)
+    parser.add_argument("--page-size", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    server = None
+    if args.url:
+        url, username, password = args.url.rstrip("/"), args.username, args.password
+    else:
+        url, username, password, server = _local_instance(args.payments)
+
+    try:
+        status, _, body = _request(
+            f"{url}/api/token", method="POST", body={"username": username, "password": password}
+        )
+        if status != 201:
+            raise SystemExit(f"token falhou ({status}): {body}")
+        statuses = run(url, body["token"], args.clients, args.seconds, args.page_size)
+    finally:
+        if server:
+            server.shutdown()
+
+    if any(code >= 500 for code in statuses):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
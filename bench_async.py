@@ -0,0 +1,117 @@
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from datetime import date
+
+import database
+
+# Benchmark da fachada assíncrona (async_repos.py):
+#   python bench_async.py [--payments 5000] [--users 8] [--repeat 20]
+#
+# Num banco temporário com --users usuários e --payments despesas cada no
+# mês atual, compara o carregamento da página de despesas (despesas do mês,
+# orçamento e categorias):
+#   sequencial  - as três consultas em sequência, uma página por vez
+#   gather      - async_repos.load_page (as três em paralelo)
+#   gather xN   - as páginas de todos os usuários ao mesmo tempo
+
+
+def _setup(n_users: int, n_payments: int):
+    tmp = tempfile.mkdtemp(prefix="bench_async_")
+    database.DB_PATH = os.path.join(tmp, "database.db")
+    database.ARCHIVE_DIR = os.path.join(tmp, "archive")
+    database.init_db()
+
+    import repos
+
+    today = date.today()
+    conn = database.get_write_connection()
+    cur = conn.cursor()
+    for user_id in range(1, n_users + 1):
+        cur.executemany(
+            """INSERT INTO payments (user_id, description, amount, due_date, month, year, created_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            [
+                (user_id, f"Despesa {i}", 10 + i % 90, today.replace(day=1 + i % 28).isoformat(),
+                 today.month, today.year, today.isoformat())
+                for i in range(n_payments)
+            ]
+        )
+    conn.commit()
+    conn.close()
+
+    for user_id in range(1, n_users + 1):
+        repos.seed_default_categories(user_id)
+        repos.upsert_budget(user_id, today.month, today.year, 5000, 3000)
+    return today.month, today.year
+
+
+def _timed(fn, repeat: int):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times), min(times)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sequencial x gather na carga de página")
+    parser.add_argument("--payments", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    month, year = _setup(args.users, args.payments)
+
+    import repos
+    import async_repos
+
+    users = range(1, args.users + 1)
+
+    def sequential_one():
+        payments = repos.list_payments(1, month, year)
+        repos.payment_totals(payments)
+        repos.get_budget(1, month, year)
+        repos.list_categories(1)
+
+    def sequential_all():
+        for user_id in users:
+            payments = repos.list_payments(user_id, month, year)
+            repos.payment_totals(payments)
+            repos.get_budget(user_id, month, year)
+            repos.list_categories(user_id)
+
+    # um único loop para todas as medições, como num job ou API assíncrona
+    loop = asyncio.new_event_loop()
+
+    def gather_one():
+        loop.run_until_complete(async_repos.load_page(1, month, year))
+
+    async def all_pages():
+        await asyncio.gather(*(async_repos.load_page(u, month, year) for u in users))
+
+    def gather_all():
+        loop.run_until_complete(all_pages())
+
+    print(f"{args.payments} despesas por usuário, {args.users} usuários, "
+          f"{async_repos.ASYNC_WORKERS} workers, mediana de {args.repeat}:")
+    try:
+        for label, fn in [
+            ("1 página   sequencial", sequential_one),
+            ("1 página   gather", gather_one),
+            (f"{args.users} páginas sequencial", sequential_all),
+            (f"{args.users} páginas gather", gather_all),
+        ]:
+            median, best = _timed(fn, args.repeat)
+            print(f"  {label:<22} {median:8.1f} ms  (mín {best:8.1f})")
+    finally:
+        loop.close()
+        async_repos.shutdown()
+
+
+if __name__ == "__main__":
+    main()
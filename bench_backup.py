@@ -0,0 +1,97 @@
+import argparse
+import io
+import os
+import tempfile
+import time
+from datetime import date
+
+import database
+
+# Benchmark de backup/restauração por usuário (backup.py):
+#   python bench_backup.py [--payments 100000]
+#
+# Num banco temporário, cria um usuário com --payments despesas (mais um
+# segundo usuário, que não pode ser afetado) e mede exportação e
+# restauração em NDJSON e em arquivo SQLite, em registros por segundo.
+
+
+def _setup(n_payments: int):
+    tmp = tempfile.mkdtemp(prefix="bench_backup_")
+    database.DB_PATH = os.path.join(tmp, "database.db")
+    database.ARCHIVE_DIR = os.path.join(tmp, "archive")
+    database.init_db()
+
+    import repos
+
+    today = date.today()
+    for user_id in (1, 2):
+        repos.seed_default_categories(user_id)
+
+    conn = database.get_write_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM categories WHERE user_id = 1")
+    cats = [r[0] for r in cur.fetchall()]
+    rows = []
+    for i in range(n_payments):
+        y = today.year - 4 + i % 5
+        m = 1 + i % 12
+        rows.append((
+            1, f"Despesa {i}", cats[i % len(cats)], 10 + i % 500,
+            date(y, m, 1 + i % 28).isoformat(), m, y, i % 2, today.isoformat()
+        ))
+    rows.append((2, "Outro usuário", None, 42, today.isoformat(), today.month, today.year, 0, today.isoformat()))
+    cur.executemany(
+        """INSERT INTO payments
+           (user_id, description, category_id, amount, due_date, month, year, paid, created_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        rows
+    )
+    conn.commit()
+    conn.close()
+    return tmp
+
+
+def _count(user_id: int) -> int:
+    conn = database.get_connection()
+    n = conn.execute("SELECT COUNT(*) FROM payments WHERE user_id = ?", (user_id,)).fetchone()[0]
+    conn.close()
+    return n
+
+
+def _timed(label, fn):
+    t0 = time.perf_counter()
+    n = fn()
+    elapsed = time.perf_counter() - t0
+    print(f"  {label:<20} {n:>8} registros  {elapsed:7.2f} s  {n / elapsed:>9.0f} registros/s")
+    return n
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Throughput de backup/restauração")
+    parser.add_argument("--payments", type=int, default=100_000)
+    args = parser.parse_args(argv)
+
+    tmp = _setup(args.payments)
+
+    import backup
+
+    print(f"Usuário com {args.payments} despesas:")
+    buf = io.StringIO()
+    _timed("export NDJSON", lambda: backup.export_user_ndjson(1, buf))
+    print(f"  {'':<20} {len(buf.getvalue().encode('utf-8')) / 1e6:.1f} MB")
+
+    path = os.path.join(tmp, "backup_user_1.db")
+    _timed("export SQLite", lambda: backup.export_user_sqlite(1, path))
+    print(f"  {'':<20} {os.path.getsize(path) / 1e6:.1f} MB")
+
+    buf.seek(0)
+    _timed("restore NDJSON", lambda: backup.restore_user_ndjson(1, buf))
+    _timed("restore SQLite", lambda: backup.restore_user_sqlite(1, path))
+
+    assert _count(1) == args.payments, "despesas perdidas na restauração"
+    assert _count(2) == 1, "restauração afetou outro usuário"
+    print("ok: contagens conferidas")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Benchmark de inicialização do app (carregamento preguiçoso de módulos):
+#   python bench_startup.py [--repeat 5]
+#
+# 1) Tempo de import, cada medição num processo Python novo (cold start):
+#      login      - o que app.py importa no topo (streamlit, database, auth, repos)
+#      dashboard  - login + plotly.graph_objects (carregado só no Dashboard)
+#      exportação - login + pandas/openpyxl/reportlab (só ao exportar)
+#      eager      - o carregamento antigo: pandas, plotly.express e
+#                   streamlit.components no topo, para comparação
+#    Também lista quais módulos pesados ficaram carregados em cada cenário.
+# 2) Primeira renderização da tela de login com streamlit.testing (AppTest),
+#    num diretório temporário (database.db e style.css próprios).
+HERE = os.path.dirname(os.path.abspath(__file__))
+HEAVY = ["pandas", "plotly", "reportlab", "openpyxl", "numpy", "streamlit.components.v1"]
+
+SCENARIOS = {
+    "login": "import streamlit, database, auth, repos",
+    "dashboard": "import streamlit, database, auth, repos; import plotly.graph_objects",
+    "exportação": "import streamlit, database, auth, repos, export_utils; "
+                  "import pandas, openpyxl; from reportlab.platypus import SimpleDocTemplate",
+    "eager": "import streamlit, database, auth, repos; import pandas, plotly.express; "
+             "import streamlit.components.v1",
+}
+
+_IMPORT_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+exec({code!r})
+elapsed = time.perf_counter() - t0
+print(json.dumps({{"ms": elapsed * 1000, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+_RENDER_PROBE = """
+import json, sys, time
+sys.path.insert(0, {here!r})
+t0 = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file({app!r}, default_timeout=120)
+at.run()
+elapsed = time.perf_counter() - t0
+if at.exception:
+    raise SystemExit(str(at.exception[0].value))
+print(json.dumps({{"ms": elapsed * 1000, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def _probe(code: str, cwd: str):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [HERE, os.environ.get("PYTHONPATH")])))
+    proc = subprocess.run(
+        [sys.executable, "-c", code], cwd=cwd, env=env, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        lines = (proc.stderr or proc.stdout).strip().splitlines()
+        return None, lines[-1] if lines else f"código {proc.returncode}"
+    return json.loads(proc.stdout.strip().splitlines()[-1]), None
+
+
+def _measure(code: str, cwd: str, repeat: int):
+    times, heavy = [], []
+    for _ in range(repeat):
+        result, error = _probe(code, cwd)
+        if error:
+            return None, error
+        times.append(result["ms"])
+        heavy = result["heavy"]
+    return {"median": statistics.median(times), "min": min(times), "heavy": heavy}, None
+
+
+def _report(label: str, result, error):
+    if error:
+        print(f"  {label:<12} indisponível: {error}")
+    else:
+        heavy = ", ".join(result["heavy"]) or "-"
+        print(f"  {label:<12} mediana {result['median']:8.1f} ms  (mín {result['min']:8.1f})  pesados: {heavy}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de inicialização do app")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix="bench_startup_")
+    try:
+        shutil.copy(os.path.join(HERE, "style.css"), tmp)
+
+        print(f"Import (processo novo, {args.repeat} execuções):")
+        for label, code in SCENARIOS.items():
+            _report(label, *_measure(_IMPORT_PROBE.format(code=code, heavy=HEAVY), tmp, args.repeat))
+
+        print("Primeira renderização (AppTest, tela de login):")
+        render = _RENDER_PROBE.format(here=HERE, app=os.path.join(HERE, "app.py"), heavy=HEAVY)
+        _report("login", *_measure(render, tmp, args.repeat))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,25 @@
 
 import io
-import pandas as pd
-from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet
+from typing import TYPE_CHECKING
+
+# pandas/openpyxl/reportlab são carregados só quando uma exportação é gerada.
+if TYPE_CHECKING:
+    import pandas as pd
+
+def export_excel_bytes(df: "pd.DataFrame", sheet_name: str = "Pagamentos") -> bytes:
+    import pandas as pd
 
-def export_excel_bytes(df: pd.DataFrame, sheet_name: str = "Pagamentos") -> bytes:
     output = io.BytesIO()
     with pd.ExcelWriter(output, engine="openpyxl") as writer:
         df.to_excel(writer, index=False, sheet_name=sheet_name)
     return output.getvalue()
 
-def export_pdf_bytes(df: pd.DataFrame, title: str = "Pagamentos") -> bytes:
+def export_pdf_bytes(df: "pd.DataFrame", title: str = "Pagamentos") -> bytes:
+    from reportlab.lib.pagesizes import A4
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet
+
     output = io.BytesIO()
     doc = SimpleDocTemplate(output, pagesize=A4)
     styles = getSampleStyleSheet()
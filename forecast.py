@@ -0,0 +1,69 @@
+import numpy as np
+from database import get_connection
+from repos import AMOUNT_BRL_SQL
+
+# -------------------- Projeção de fluxo de caixa --------------------
+def load_forecast_inputs(user_id: int, month: int, year: int, horizon: int = 12):
+    """
+    Carrega numa única consulta as despesas (parcelas incluídas, em BRL) do período
+    projetado e os orçamentos até o fim dele. Retorna (kind, period, value)
+    como arrays, com kind 0 = despesa, 1 = renda e period = ano * 12 + mês - 1.
+    """
+    last_year = year + (month + horizon - 2) // 12
+
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(
+        f"""SELECT 0, p.year * 12 + p.month - 1, {AMOUNT_BRL_SQL}, p.paid FROM payments p
+           WHERE p.user_id = ? AND p.year BETWEEN ? AND ?
+           UNION ALL
+           SELECT 1, year * 12 + month - 1, income, 0 FROM budgets
+           WHERE user_id = ? AND year <= ?""",
+        (user_id, year, last_year, user_id, last_year)
+    )
+    rows = cur.fetchall()
+    conn.close()
+
+    data = np.array(rows, dtype=float).reshape(-1, 4)
+    return (
+        data[:, 0].astype(np.int8),
+        data[:, 1].astype(np.int64),
+        data[:, 2],
+        data[:, 3].astype(bool),
+    )
+
+def project_balance(user_id: int, month: int, year: int, horizon: int = 12):
+    """
+    Projeta mês a mês, a partir de (month, year), a renda, as despesas já
+    lançadas (total e em aberto) e o saldo acumulado. Meses sem orçamento
+    repetem a última renda cadastrada.
+    """
+    kind, period, value, paid = load_forecast_inputs(user_id, month, year, horizon)
+    start = year * 12 + month - 1
+    months = np.arange(start, start + horizon)
+
+    is_exp = (kind == 0) & (period >= start) & (period < start + horizon)
+    offsets = period[is_exp] - start
+    expenses = np.bincount(offsets, weights=value[is_exp], minlength=horizon).astype(float)
+    open_mask = ~paid[is_exp]
+    open_expenses = np.bincount(
+        offsets[open_mask], weights=value[is_exp][open_mask], minlength=horizon
+    ).astype(float)
+
+    is_inc = kind == 1
+    order = np.argsort(period[is_inc], kind="stable")
+    inc_period = period[is_inc][order]
+    inc_value = value[is_inc][order]
+    pos = np.searchsorted(inc_period, months, side="right") - 1
+    income = np.where(pos >= 0, inc_value[np.clip(pos, 0, None)] if inc_value.size else 0.0, 0.0)
+
+    net = income - expenses
+    return {
+        "month": months % 12 + 1,
+        "year": months // 12,
+        "income": income,
+        "expenses": expenses,
+        "open": open_expenses,
+        "net": net,
+        "balance": np.cumsum(net),
+    }
@@ -1,9 +1,39 @@
+import csv
 import datetime
-from database import get_connection
+import io
+import json
+import threading
+import time
+from typing import NamedTuple
+from database import get_connection, get_write_connection, begin_write, attach_archive, is_postgres
 
 def _now():
     return datetime.datetime.now().isoformat(timespec="seconds")
 
+class ConflictError(Exception):
+    """A linha foi alterada por outra sessão desde que foi lida."""
+
+# -------------------- Versão dos dados --------------------
+def _bump_version(cur, user_id: int):
+    """
+    Incrementa o contador de escrita do usuário. Toda função que altera
+    dados chama isto na mesma transação, para que caches (gráficos do
+    Dashboard etc.) possam usar a versão como chave.
+    """
+    cur.execute(
+        """INSERT INTO data_versions (user_id, version) VALUES (?, 1)
+           ON CONFLICT(user_id) DO UPDATE SET version = data_versions.version + 1""",
+        (user_id,)
+    )
+
+def get_data_version(user_id: int) -> int:
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT version FROM data_versions WHERE user_id = ?", (user_id,))
+    row = cur.fetchone()
+    conn.close()
+    return row[0] if row else 0
+
 # -------------------- Default Categories --------------------
 DEFAULT_CATEGORIES = [
     "Aluguel",
@@ -57,26 +87,47 @@ def create_category(user_id: int, name: str):
     name = (name or "").strip()
     if not name:
         raise ValueError("Nome da categoria é obrigatório.")
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO categories (user_id, name, created_at) VALUES (?, ?, ?)",
-        (user_id, name, _now())
-    )
-    conn.commit()
-    conn.close()
+    conn = get_write_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT INTO categories (user_id, name, created_at) VALUES (?, ?, ?)",
+            (user_id, name, _now())
+        )
+        _bump_version(cur, user_id)
+        conn.commit()
+    finally:
+        conn.close()
 
 def delete_category(user_id: int, category_id: int):
-    conn = get_connection()
+    conn = get_write_connection()
     cur = conn.cursor()
     cur.execute(
-        "UPDATE payments SET category_id = NULL WHERE user_id = ? AND category_id = ?",
+        "UPDATE payments SET category_id = NULL, version = version + 1 WHERE user_id = ? AND category_id = ?",
         (user_id, category_id)
     )
     cur.execute(
         "DELETE FROM categories WHERE user_id = ? AND id = ?",
         (user_id, category_id)
     )
+    # os gastos da categoria passam para "sem categoria" (0) nos contadores
+    cur.execute(
+        """INSERT INTO spend_counters (user_id, month, year, category_id, total)
+           SELECT user_id, month, year, 0, total FROM spend_counters
+           WHERE user_id = ? AND category_id = ?
+           ON CONFLICT(user_id, year, month, category_id)
+           DO UPDATE SET total = spend_counters.total + excluded.total""",
+        (user_id, category_id)
+    )
+    cur.execute(
+        "DELETE FROM spend_counters WHERE user_id = ? AND category_id = ?",
+        (user_id, category_id)
+    )
+    cur.execute(
+        "DELETE FROM category_limits WHERE user_id = ? AND category_id = ?",
+        (user_id, category_id)
+    )
+    _bump_version(cur, user_id)
     conn.commit()
     conn.close()
 
@@ -91,7 +142,17 @@ def seed_default_categories(user_id: int):
 
     conn = get_connection()
     cur = conn.cursor()
+    cur.execute(
+        f"""SELECT COUNT(*) FROM categories
+            WHERE user_id = ? AND name IN ({', '.join('?' for _ in DEFAULT_CATEGORIES)})""",
+        (user_id, *DEFAULT_CATEGORIES)
+    )
+    if cur.fetchone()[0] == len(DEFAULT_CATEGORIES):
+        conn.close()
+        return
 
+    begin_write(conn)
+    inserted = 0
     for name in DEFAULT_CATEGORIES:
         cur.execute(
             """
@@ -101,12 +162,172 @@ def seed_default_categories(user_id: int):
             """,
             (user_id, name, _now())
         )
+        inserted += max(cur.rowcount, 0)
 
+    if inserted:
+        _bump_version(cur, user_id)
     conn.commit()
     conn.close()
 
 
+# -------------------- Câmbio --------------------
+# Valor da despesa convertido para BRL pela cotação mais recente até o
+# vencimento (ou, se não houver, a primeira cotação posterior). Usado nos
+# agregados para que os totais do mês continuem numa única consulta.
+AMOUNT_BRL_SQL = """(p.amount * CASE WHEN p.currency = 'BRL' THEN 1.0 ELSE COALESCE(
+        (SELECT f.rate FROM fx_rates f
+         WHERE f.currency = p.currency AND f.rate_date <= p.due_date
+         ORDER BY f.rate_date DESC LIMIT 1),
+        (SELECT f.rate FROM fx_rates f
+         WHERE f.currency = p.currency
+         ORDER BY f.rate_date ASC LIMIT 1),
+        1.0) END)"""
+
+def _fx_rate(cur, currency: str, on_date: str):
+    """Cotação (em BRL) da moeda na data, pela regra de AMOUNT_BRL_SQL; None se não houver."""
+    if currency == "BRL":
+        return 1.0
+    cur.execute(
+        """SELECT rate FROM fx_rates
+           WHERE currency = ?
+           ORDER BY CASE WHEN rate_date <= ? THEN 0 ELSE 1 END,
+                    CASE WHEN rate_date <= ? THEN rate_date END DESC,
+                    rate_date ASC
+           LIMIT 1""",
+        (currency, on_date, on_date)
+    )
+    row = cur.fetchone()
+    return float(row[0]) if row else None
+
+def list_currencies():
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT DISTINCT currency FROM fx_rates ORDER BY currency")
+    currencies = ["BRL"] + [r[0] for r in cur.fetchall() if r[0] != "BRL"]
+    conn.close()
+    return currencies
+
+def _fx_affected_filter(cur, cleaned):
+    """
+    Filtro (SQL, parâmetros) das despesas cuja conversão muda com as novas
+    cotações: por moeda, as que vencem a partir da menor data carregada e,
+    se ela não for posterior à primeira cotação já existente, também as
+    anteriores a esta (que usam a primeira cotação como referência).
+    """
+    first_new = {}
+    for currency, rate_date, _ in cleaned:
+        first_new[currency] = min(rate_date, first_new.get(currency, rate_date))
+
+    clauses, params = [], []
+    for currency, new_min in first_new.items():
+        cur.execute("SELECT MIN(rate_date) FROM fx_rates WHERE currency = ?", (currency,))
+        old_min = cur.fetchone()[0]
+        if old_min is None:
+            before = "9999-12-31"
+        elif new_min <= old_min:
+            before = old_min
+        else:
+            before = ""
+        clauses.append("(p.currency = ? AND (p.due_date >= ? OR p.due_date < ?))")
+        params += [currency, new_min, before]
+    return " OR ".join(clauses), params
+
+def load_fx_rates(rates):
+    """
+    Grava cotações (moeda, data ISO, valor em BRL), substituindo as já
+    existentes para a mesma moeda e data. Na mesma transação refaz os
+    contadores de gastos dos meses com despesas afetadas e incrementa a
+    versão dos usuários donos delas. Retorna quantas foram gravadas.
+    """
+    cleaned = []
+    for currency, rate_date, rate in rates:
+        currency = (currency or "").strip().upper()
+        rate_date = datetime.date.fromisoformat(str(rate_date).strip()).isoformat()
+        rate = float(rate)
+        if len(currency) != 3 or rate <= 0:
+            raise ValueError(f"Cotação inválida: {currency} {rate_date} {rate}")
+        cleaned.append((currency, rate_date, rate))
+    if not cleaned:
+        return 0
+
+    conn = get_write_connection()
+    try:
+        cur = conn.cursor()
+        where, params = _fx_affected_filter(cur, cleaned)
+        cur.execute(
+            f"""SELECT DISTINCT p.user_id, p.month, p.year, COALESCE(p.category_id, 0)
+                FROM payments p WHERE {where}""",
+            params
+        )
+        keys = cur.fetchall()
+
+        cur.executemany(
+            """INSERT INTO fx_rates (currency, rate_date, rate) VALUES (?, ?, ?)
+               ON CONFLICT(currency, rate_date) DO UPDATE SET rate = excluded.rate""",
+            cleaned
+        )
+
+        cur.executemany(
+            """DELETE FROM spend_counters
+               WHERE user_id = ? AND month = ? AND year = ? AND category_id = ?""",
+            keys
+        )
+        cur.executemany(
+            f"""INSERT INTO spend_counters (user_id, month, year, category_id, total)
+                SELECT p.user_id, p.month, p.year, COALESCE(p.category_id, 0), SUM({AMOUNT_BRL_SQL})
+                FROM payments p
+                WHERE p.user_id = ? AND p.month = ? AND p.year = ? AND COALESCE(p.category_id, 0) = ?
+                GROUP BY p.user_id, p.month, p.year, COALESCE(p.category_id, 0)""",
+            keys
+        )
+        for user_id in sorted({k[0] for k in keys}):
+            _bump_version(cur, user_id)
+        conn.commit()
+    finally:
+        conn.close()
+    return len(cleaned)
+
+def load_fx_rates_csv(f):
+    """
+    Carrega cotações de um CSV local com cabeçalho currency,date,rate
+    (ex.: USD,2024-03-01,4.97). Aceita arquivo texto ou binário.
+    """
+    if isinstance(f, (bytes, bytearray)):
+        f = io.StringIO(f.decode("utf-8-sig"))
+    elif not isinstance(f, io.TextIOBase):
+        f = io.TextIOWrapper(f, encoding="utf-8-sig")
+    reader = csv.DictReader(f)
+    return load_fx_rates((r["currency"], r["date"], r["rate"]) for r in reader)
+
 # -------------------- Payments / Despesas --------------------
+class Payment(NamedTuple):
+    """Linha de despesa retornada por list_payments (compacta, sem DataFrame)."""
+    id: int
+    description: str
+    amount: float
+    due_date: str
+    paid: int
+    paid_date: str | None
+    category_id: int | None
+    category_name: str | None
+    is_credit: int
+    installments: int
+    installment_index: int
+    credit_group: int | None
+    version: int
+    currency: str
+    amount_brl: float
+
+def payment_totals(rows):
+    """Total, pago e em aberto do mês (em BRL) numa única passada pelas linhas."""
+    total = 0.0
+    paid = 0.0
+    for r in rows:
+        total += r.amount_brl
+        if r.paid:
+            paid += r.amount_brl
+    return {"total": total, "paid": paid, "open": total - paid}
+
 def add_payment(
     user_id: int,
     description: str,
@@ -116,7 +337,8 @@ def add_payment(
     year: int,
     category_id=None,
     is_credit: int = 0,
-    installments: int = 1
+    installments: int = 1,
+    currency: str = "BRL"
 ):
     description = (description or "").strip()
     if not description:
@@ -124,24 +346,44 @@ def add_payment(
     if amount <= 0:
         raise ValueError("Valor deve ser maior que zero.")
 
-    conn = get_connection()
+    currency = (currency or "BRL").strip().upper()
+
+    conn = get_write_connection()
     cur = conn.cursor()
 
+    rate = _fx_rate(cur, currency, due_date)
+    if rate is None:
+        conn.close()
+        raise ValueError(f"Sem cotação cadastrada para {currency}.")
+
+    n_months = int(installments) if is_credit else 1
+    last_year = year + (month + max(n_months, 1) - 2) // 12
+    if _archived_years_between(cur, user_id, year, last_year):
+        conn.close()
+        raise ValueError(ARCHIVED_YEAR_MSG)
+    if _closed_months_between(cur, user_id, month, year, n_months):
+        conn.close()
+        raise ValueError(MONTH_CLOSED_MSG)
+
     if not is_credit or installments == 1:
         cur.execute(
             """INSERT INTO payments
                (user_id, description, category_id, amount, due_date,
                 month, year, paid, paid_date, created_at,
-                is_credit, installments, installment_index, credit_group)
-               VALUES (?, ?, ?, ?, ?, ?, ?, 0, NULL, ?, 0, 1, 1, NULL)""",
-            (user_id, description, category_id, amount, due_date, month, year, _now())
+                is_credit, installments, installment_index, credit_group, currency)
+               VALUES (?, ?, ?, ?, ?, ?, ?, 0, NULL, ?, 0, 1, 1, NULL, ?)
+               RETURNING id""",
+            (user_id, description, category_id, amount, due_date, month, year, _now(), currency)
         )
+        ids = [cur.fetchone()[0]]
+        _apply_spend(cur, user_id, month, year, category_id, amount * rate)
     else:
         cur.execute("SELECT COALESCE(MAX(credit_group),0)+1 FROM payments")
         group_id = cur.fetchone()[0]
 
         parcela_valor = round(amount / installments, 2)
 
+        ids = []
         for i in range(installments):
             m = month + i
             y = year
@@ -153,8 +395,9 @@ def add_payment(
                 """INSERT INTO payments
                    (user_id, description, category_id, amount, due_date,
                     month, year, paid, paid_date, created_at,
-                    is_credit, installments, installment_index, credit_group)
-                   VALUES (?, ?, ?, ?, ?, ?, ?, 0, NULL, ?, 1, ?, ?, ?)""",
+                    is_credit, installments, installment_index, credit_group, currency)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, 0, NULL, ?, 1, ?, ?, ?, ?)
+                   RETURNING id""",
                 (
                     user_id,
                     f"{description} ({i+1}/{installments})",
@@ -166,71 +409,214 @@ def add_payment(
                     _now(),
                     installments,
                     i + 1,
-                    group_id
+                    group_id,
+                    currency
                 )
             )
+            ids.append(cur.fetchone()[0])
+            _apply_spend(cur, user_id, m, y, category_id, parcela_valor * rate)
 
+    _bump_version(cur, user_id)
     conn.commit()
     conn.close()
+    return ids
+
+def month_totals(user_id: int, month: int, year: int):
+    """Total, pago e em aberto do mês em BRL, numa única consulta."""
+    snapshot = get_month_snapshot(user_id, month, year)
+    if snapshot:
+        return snapshot["totals"]
+
+    conn = get_connection()
+    table = _payments_table(conn, user_id, year)
+    cur = conn.cursor()
+    cur.execute(
+        f"""SELECT COALESCE(SUM({AMOUNT_BRL_SQL}), 0),
+                  COALESCE(SUM(CASE WHEN p.paid = 1 THEN {AMOUNT_BRL_SQL} ELSE 0 END), 0)
+           FROM {table} p
+           WHERE p.user_id = ? AND p.month = ? AND p.year = ?""",
+        (user_id, month, year)
+    )
+    total, paid = (float(v) for v in cur.fetchone())
+    conn.close()
+    return {"total": total, "paid": paid, "open": total - paid}
 
 def list_payments(user_id: int, month: int, year: int):
+    """Despesas do mês; meses fechados vêm direto do snapshot."""
+    snapshot = get_month_snapshot(user_id, month, year)
+    if snapshot:
+        return snapshot["rows"]
+
+    conn = get_connection()
+    rows = _query_payments(conn, user_id, month, year)
+    conn.close()
+    return rows
+
+def list_payments_page(user_id: int, month: int, year: int, offset: int, limit: int):
+    """
+    Uma página das despesas do mês e o total de linhas do mês. Em meses
+    abertos LIMIT/OFFSET e COUNT(*) ficam no banco (a conversão para BRL
+    só roda nas linhas da página); meses fechados são fatiados do snapshot.
+    """
+    snapshot = get_month_snapshot(user_id, month, year)
+    if snapshot:
+        rows = snapshot["rows"]
+        return rows[offset:offset + limit], len(rows)
+
     conn = get_connection()
+    try:
+        table = _payments_table(conn, user_id, year)
+        cur = conn.cursor()
+        cur.execute(
+            f"SELECT COUNT(*) FROM {table} p WHERE p.user_id = ? AND p.month = ? AND p.year = ?",
+            (user_id, month, year)
+        )
+        total = cur.fetchone()[0]
+        rows = _query_payments(conn, user_id, month, year, limit=limit, offset=offset) if total else []
+    finally:
+        conn.close()
+    return rows, total
+
+def _query_payments(conn, user_id: int, month: int, year: int, limit=None, offset: int = 0):
+    table = _payments_table(conn, user_id, year)
+    sql = f"""SELECT p.id, p.description, p.amount, p.due_date, p.paid, p.paid_date,
+                     p.category_id, c.name,
+                     p.is_credit, p.installments, p.installment_index, p.credit_group,
+                     p.version, p.currency, {AMOUNT_BRL_SQL}
+              FROM {table} p
+              LEFT JOIN categories c ON c.id = p.category_id AND c.user_id = p.user_id
+              WHERE p.user_id = ? AND p.month = ? AND p.year = ?
+              ORDER BY p.paid ASC, p.due_date ASC, p.id DESC"""
+    params = [user_id, month, year]
+    if limit is not None:
+        sql += " LIMIT ? OFFSET ?"
+        params += [limit, offset]
+    cur = conn.cursor()
+    cur.execute(sql, params)
+    return [Payment._make(r) for r in cur.fetchall()]
+
+def category_totals(user_id: int, month: int, year: int):
+    """Total e total pago (em BRL) por categoria no mês, agregados no banco."""
+    snapshot = get_month_snapshot(user_id, month, year)
+    if snapshot:
+        by_cat = {}
+        for r in snapshot["rows"]:
+            total, paid = by_cat.get(r.category_name, (0.0, 0.0))
+            by_cat[r.category_name] = (total + r.amount_brl, paid + (r.amount_brl if r.paid else 0.0))
+        return sorted(
+            ((name, total, paid) for name, (total, paid) in by_cat.items()),
+            key=lambda row: row[1],
+            reverse=True
+        )
+
+    conn = get_connection()
+    table = _payments_table(conn, user_id, year)
     cur = conn.cursor()
     cur.execute(
-        """SELECT p.id, p.description, p.amount, p.due_date, p.paid, p.paid_date,
-                  p.category_id, c.name,
-                  p.is_credit, p.installments, p.installment_index, p.credit_group
-           FROM payments p
-           LEFT JOIN categories c ON c.id = p.category_id
+        f"""SELECT c.name,
+                  SUM({AMOUNT_BRL_SQL}),
+                  SUM(CASE WHEN p.paid = 1 THEN {AMOUNT_BRL_SQL} ELSE 0 END)
+           FROM {table} p
+           LEFT JOIN categories c ON c.id = p.category_id AND c.user_id = p.user_id
            WHERE p.user_id = ? AND p.month = ? AND p.year = ?
-           ORDER BY p.paid ASC, p.due_date ASC, p.id DESC""",
+           GROUP BY c.name
+           ORDER BY 2 DESC""",
         (user_id, month, year)
     )
     rows = cur.fetchall()
     conn.close()
     return rows
 
-def mark_paid(user_id: int, payment_id: int, paid: bool):
-    conn = get_connection()
+def _set_paid(cur, user_id: int, payment_id: int, paid: bool, expected_version=None) -> bool:
+    """
+    Marca/desmarca a despesa como paga. Com expected_version, só grava se a
+    linha ainda estiver nessa versão (compare-and-swap). Retorna se gravou.
+    """
+    sql = f"""UPDATE payments SET paid = ?, paid_date = ?, version = version + 1
+              WHERE user_id = ? AND id = ? AND {_OPEN_MONTH_SQL}"""
+    params = [1 if paid else 0, _now() if paid else None, user_id, payment_id]
+    if expected_version is not None:
+        sql += " AND version = ?"
+        params.append(expected_version)
+    cur.execute(sql, params)
+    return cur.rowcount > 0
+
+def _row_version(cur, user_id: int, payment_id: int):
+    cur.execute("SELECT version FROM payments WHERE user_id = ? AND id = ?", (user_id, payment_id))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+def mark_paid(user_id: int, payment_id: int, paid: bool, expected_version=None):
+    """
+    Marca/desmarca a despesa. Retorna a nova versão da linha, ou None se a
+    despesa não existir para o usuário.
+    """
+    conn = get_write_connection()
     cur = conn.cursor()
 
-    if paid:
-        cur.execute(
-            "UPDATE payments SET paid = 1, paid_date = ? WHERE user_id = ? AND id = ?",
-            (_now(), user_id, payment_id)
-        )
-    else:
-        cur.execute(
-            "UPDATE payments SET paid = 0, paid_date = NULL WHERE user_id = ? AND id = ?",
-            (user_id, payment_id)
-        )
+    if not _set_paid(cur, user_id, payment_id, paid, expected_version):
+        closed = _payment_month_closed(cur, user_id, payment_id)
+        exists = _row_version(cur, user_id, payment_id) is not None
+        conn.close()
+        if closed:
+            raise ValueError(MONTH_CLOSED_MSG)
+        if not exists:
+            return None
+        if expected_version is not None:
+            raise ConflictError("Despesa alterada em outra sessão. Recarregue e tente novamente.")
+        return None
 
+    version = _row_version(cur, user_id, payment_id)
+    _bump_version(cur, user_id)
     conn.commit()
     conn.close()
+    return version
 
-def delete_payment(user_id: int, payment_id: int):
-    conn = get_connection()
+def delete_payment(user_id: int, payment_id: int, expected_version=None):
+    conn = get_write_connection()
     cur = conn.cursor()
     cur.execute(
-        "DELETE FROM payments WHERE user_id = ? AND id = ?",
+        f"""SELECT p.month, p.year, p.category_id, {AMOUNT_BRL_SQL}
+            FROM payments p WHERE p.user_id = ? AND p.id = ?""",
         (user_id, payment_id)
     )
+    old = cur.fetchone()
+    if old and _closed_months_between(cur, user_id, old[0], old[1], 1):
+        conn.close()
+        raise ValueError(MONTH_CLOSED_MSG)
+
+    sql = "DELETE FROM payments WHERE user_id = ? AND id = ?"
+    params = [user_id, payment_id]
+    if expected_version is not None:
+        sql += " AND version = ?"
+        params.append(expected_version)
+    cur.execute(sql, params)
+
+    if expected_version is not None and cur.rowcount == 0:
+        conn.close()
+        raise ConflictError("Despesa alterada em outra sessão. Recarregue e tente novamente.")
+
+    if old:
+        _apply_spend(cur, user_id, old[0], old[1], old[2], -float(old[3]))
+    _bump_version(cur, user_id)
     conn.commit()
     conn.close()
 
 # -------------------- Fatura Cartão --------------------
 def mark_credit_invoice_paid(user_id: int, month: int, year: int):
-    conn = get_connection()
+    conn = get_write_connection()
     cur = conn.cursor()
 
     cur.execute(
-        """
+        f"""
         UPDATE payments
         SET paid = 1,
-            paid_date = ?
+            paid_date = ?,
+            version = version + 1
         WHERE user_id = ?
           AND month = ?
           AND year = ?
+          AND {_OPEN_MONTH_SQL}
           AND category_id IN (
               SELECT id FROM categories
               WHERE user_id = ?
@@ -240,21 +626,24 @@ def mark_credit_invoice_paid(user_id: int, month: int, year: int):
         (_now(), user_id, month, year, user_id)
     )
 
+    _bump_version(cur, user_id)
     conn.commit()
     conn.close()
 
 def unmark_credit_invoice_paid(user_id: int, month: int, year: int):
-    conn = get_connection()
+    conn = get_write_connection()
     cur = conn.cursor()
 
     cur.execute(
-        """
+        f"""
         UPDATE payments
         SET paid = 0,
-            paid_date = NULL
+            paid_date = NULL,
+            version = version + 1
         WHERE user_id = ?
           AND month = ?
           AND year = ?
+          AND {_OPEN_MONTH_SQL}
           AND category_id IN (
               SELECT id FROM categories
               WHERE user_id = ?
@@ -264,6 +653,7 @@ def unmark_credit_invoice_paid(user_id: int, month: int, year: int):
         (user_id, month, year, user_id)
     )
 
+    _bump_version(cur, user_id)
     conn.commit()
     conn.close()
 
@@ -282,7 +672,7 @@ def get_budget(user_id: int, month: int, year: int):
     return {"income": 0.0, "expense_goal": 0.0}
 
 def upsert_budget(user_id: int, month: int, year: int, income: float, expense_goal: float):
-    conn = get_connection()
+    conn = get_write_connection()
     cur = conn.cursor()
     cur.execute(
         """INSERT INTO budgets (user_id, month, year, income, expense_goal, created_at)
@@ -292,6 +682,7 @@ def upsert_budget(user_id: int, month: int, year: int, income: float, expense_go
                          expense_goal = excluded.expense_goal""",
         (user_id, month, year, income, expense_goal, _now())
     )
+    _bump_version(cur, user_id)
     conn.commit()
     conn.close()
 
@@ -300,7 +691,7 @@ def merge_credit_group(user_id: int, payment_ids: list[int]):
     if not payment_ids:
         return
 
-    conn = get_connection()
+    conn = get_write_connection()
     cur = conn.cursor()
 
     # gera um novo grupo (compatível com seu schema atual)
@@ -311,12 +702,13 @@ def merge_credit_group(user_id: int, payment_ids: list[int]):
         cur.execute(
             """
             UPDATE payments
-            SET credit_group = ?, is_credit = 1
+            SET credit_group = ?, is_credit = 1, version = version + 1
             WHERE user_id = ? AND id = ?
             """,
             (new_group, user_id, pid)
         )
 
+    _bump_version(cur, user_id)
     conn.commit()
     conn.close()
 
@@ -327,38 +719,621 @@ def update_payment(
     description: str,
     amount: float,
     due_date: str,
-    category_id=None
+    category_id=None,
+    expected_version=None
 ):
     from datetime import datetime
 
     d = datetime.fromisoformat(due_date)
 
-    conn = get_connection()
+    conn = get_write_connection()
     cur = conn.cursor()
 
     cur.execute(
-        """
+        f"""SELECT p.month, p.year, p.category_id, {AMOUNT_BRL_SQL}, p.credit_group, p.currency
+            FROM payments p WHERE p.user_id = ? AND p.id = ?""",
+        (user_id, payment_id)
+    )
+    old = cur.fetchone()
+    if not old:
+        conn.close()
+        return
+
+    old_month, old_year, old_cat, old_amount, group, currency = old
+    new_amount = amount * (_fx_rate(cur, currency, due_date) or 1.0)
+
+    # parcelas mantêm o mês/ano da distribuição original do parcelamento
+    if group is None:
+        new_month, new_year = d.month, d.year
+    else:
+        new_month, new_year = old_month, old_year
+
+    if (
+        _closed_months_between(cur, user_id, old_month, old_year, 1)
+        or _closed_months_between(cur, user_id, new_month, new_year, 1)
+    ):
+        conn.close()
+        raise ValueError(MONTH_CLOSED_MSG)
+    # a linha ficaria em main.payments num ano lido só do arquivo
+    if _archived_years_between(cur, user_id, new_year, new_year):
+        conn.close()
+        raise ValueError(ARCHIVED_YEAR_MSG)
+
+    sql = """
         UPDATE payments
         SET description = ?,
             amount = ?,
             due_date = ?,
             month = ?,
             year = ?,
-            category_id = ?
+            category_id = ?,
+            version = version + 1
         WHERE user_id = ?
           AND id = ?
+        """
+    params = [
+        description,
+        amount,
+        due_date,
+        new_month,
+        new_year,
+        category_id,
+        user_id,
+        payment_id
+    ]
+    if expected_version is not None:
+        sql += " AND version = ?"
+        params.append(expected_version)
+    cur.execute(sql, params)
+
+    if cur.rowcount == 0:
+        conn.close()
+        raise ConflictError("Despesa alterada em outra sessão. Recarregue e tente novamente.")
+
+    if (old_month, old_year, old_cat or 0) == (new_month, new_year, category_id or 0):
+        _apply_spend(cur, user_id, new_month, new_year, category_id, new_amount - float(old_amount))
+    else:
+        _apply_spend(cur, user_id, old_month, old_year, old_cat, -float(old_amount))
+        _apply_spend(cur, user_id, new_month, new_year, category_id, new_amount)
+
+    _bump_version(cur, user_id)
+    conn.commit()
+    conn.close()
+
+# -------------------- Parcelamentos (grupo inteiro) --------------------
+def _group_spend(cur, user_id: int, group_id: int):
+    cur.execute(
+        f"""SELECT p.month, p.year, COALESCE(p.category_id, 0), SUM({AMOUNT_BRL_SQL})
+           FROM payments p
+           WHERE p.user_id = ? AND p.credit_group = ?
+           GROUP BY p.month, p.year, COALESCE(p.category_id, 0)""",
+        (user_id, group_id)
+    )
+    return {(m, y, c): float(total) for m, y, c, total in cur.fetchall()}
+
+def _apply_spend_diff(cur, user_id: int, before: dict, after: dict):
+    """Aplica nos contadores a diferença entre dois agregados de _group_spend."""
+    diffs = {k: after.get(k, 0.0) - before.get(k, 0.0) for k in before.keys() | after.keys()}
+    # reduções primeiro, para os alertas compararem com o total já ajustado
+    for (m, y, c), delta in sorted(diffs.items(), key=lambda kv: kv[1]):
+        if abs(delta) > 1e-9:
+            _apply_spend(cur, user_id, m, y, c, delta)
+
+def list_credit_group(user_id: int, group_id: int):
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(
+        f"""SELECT p.id, p.description, p.amount, p.due_date, p.paid, p.paid_date,
+                  p.category_id, c.name,
+                  p.is_credit, p.installments, p.installment_index, p.credit_group,
+                  p.version, p.currency, {AMOUNT_BRL_SQL}
+           FROM payments p
+           LEFT JOIN categories c ON c.id = p.category_id AND c.user_id = p.user_id
+           WHERE p.user_id = ? AND p.credit_group = ?
+           ORDER BY p.year, p.month, p.installment_index""",
+        (user_id, group_id)
+    )
+    rows = [Payment._make(r) for r in cur.fetchall()]
+    conn.close()
+    return rows
+
+def update_credit_group(
+    user_id: int,
+    group_id: int,
+    description: str,
+    category_id=None,
+    installment_amount: float | None = None
+):
+    """
+    Altera descrição e categoria de todas as parcelas do grupo e, se
+    informado, o valor das parcelas ainda em aberto. Mês/ano de cada
+    parcela não mudam.
+    """
+    description = (description or "").strip()
+    if not description:
+        raise ValueError("Descrição é obrigatória.")
+    if installment_amount is not None and installment_amount <= 0:
+        raise ValueError("Valor deve ser maior que zero.")
+
+    conn = get_write_connection()
+    cur = conn.cursor()
+    before = _group_spend(cur, user_id, group_id)
+
+    cur.execute(
+        f"""
+        UPDATE payments
+        SET description = CASE
+                WHEN installments > 1
+                THEN ? || ' (' || installment_index || '/' || installments || ')'
+                ELSE ?
+            END,
+            category_id = ?,
+            version = version + 1
+        WHERE user_id = ? AND credit_group = ? AND {_OPEN_MONTH_SQL}
         """,
-        (
-            description,
-            amount,
-            due_date,
-            d.month,
-            d.year,
-            category_id,
-            user_id,
-            payment_id
+        (description, description, category_id, user_id, group_id)
+    )
+    if installment_amount is not None:
+        cur.execute(
+            f"""UPDATE payments SET amount = ?, version = version + 1
+               WHERE user_id = ? AND credit_group = ? AND paid = 0 AND {_OPEN_MONTH_SQL}""",
+            (installment_amount, user_id, group_id)
+        )
+
+    _apply_spend_diff(cur, user_id, before, _group_spend(cur, user_id, group_id))
+    _bump_version(cur, user_id)
+    conn.commit()
+    conn.close()
+
+def cancel_remaining_installments(user_id: int, group_id: int):
+    """Exclui as parcelas ainda não pagas do grupo. Retorna quantas foram excluídas."""
+    conn = get_write_connection()
+    cur = conn.cursor()
+    before = _group_spend(cur, user_id, group_id)
+
+    cur.execute(
+        f"""DELETE FROM payments
+            WHERE user_id = ? AND credit_group = ? AND paid = 0 AND {_OPEN_MONTH_SQL}""",
+        (user_id, group_id)
+    )
+    removed = cur.rowcount
+
+    _apply_spend_diff(cur, user_id, before, _group_spend(cur, user_id, group_id))
+    _bump_version(cur, user_id)
+    conn.commit()
+    conn.close()
+    return removed
+
+def prepay_credit_group(user_id: int, group_id: int, month: int, year: int):
+    """
+    Antecipa as parcelas em aberto do grupo: passam para (month, year) e
+    ficam pagas na data de hoje. Retorna quantas parcelas foram quitadas.
+    """
+    conn = get_write_connection()
+    cur = conn.cursor()
+    if _closed_months_between(cur, user_id, month, year, 1):
+        conn.close()
+        raise ValueError(MONTH_CLOSED_MSG)
+    if _archived_years_between(cur, user_id, year, year):
+        conn.close()
+        raise ValueError(ARCHIVED_YEAR_MSG)
+    before = _group_spend(cur, user_id, group_id)
+
+    cur.execute(
+        f"""
+        UPDATE payments
+        SET month = ?,
+            year = ?,
+            paid = 1,
+            paid_date = ?,
+            version = version + 1
+        WHERE user_id = ? AND credit_group = ? AND paid = 0 AND {_OPEN_MONTH_SQL}
+        """,
+        (month, year, _now(), user_id, group_id)
+    )
+    prepaid = cur.rowcount
+
+    _apply_spend_diff(cur, user_id, before, _group_spend(cur, user_id, group_id))
+    _bump_version(cur, user_id)
+    conn.commit()
+    conn.close()
+    return prepaid
+
+# -------------------- Arquivo (anos encerrados) --------------------
+ARCHIVED_YEAR_MSG = "Ano arquivado: não é possível cadastrar ou mover despesas para ele."
+
+def _archived_years_between(cur, user_id: int, first_year: int, last_year: int):
+    cur.execute(
+        "SELECT year FROM archived_years WHERE user_id = ? AND year BETWEEN ? AND ?",
+        (user_id, first_year, last_year)
+    )
+    return [r[0] for r in cur.fetchall()]
+
+def _payments_table(conn, user_id: int, year: int) -> str:
+    """
+    Retorna a tabela que guarda as despesas do ano: a ativa ("payments")
+    ou, se o ano foi arquivado, a do arquivo do usuário (já anexado a conn).
+    """
+    cur = conn.cursor()
+    if not is_postgres() and _archived_years_between(cur, user_id, year, year):
+        attach_archive(conn, user_id)
+        return "archive.payments"
+    return "payments"
+
+def is_year_archived(user_id: int, year: int) -> bool:
+    conn = get_connection()
+    archived = bool(_archived_years_between(conn.cursor(), user_id, year, year))
+    conn.close()
+    return archived
+
+def list_archived_years(user_id: int):
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT year FROM archived_years WHERE user_id = ? ORDER BY year",
+        (user_id,)
+    )
+    years = [r[0] for r in cur.fetchall()]
+    conn.close()
+    return years
+
+def archive_closed_years(user_id: int):
+    """
+    Move para o arquivo do usuário os anos anteriores ao atual em que
+    todas as despesas estão pagas. Retorna a lista de anos arquivados.
+    No PostgreSQL o arquivo não se aplica (nada é movido).
+    """
+    if is_postgres():
+        return []
+
+    # ATTACH não pode ocorrer dentro de transação; a escolha dos anos é
+    # feita já com o lock, para não arquivar despesa em aberto recém-criada.
+    conn = get_connection()
+    cur = attach_archive(conn, user_id)
+    begin_write(conn)
+    cur.execute(
+        """SELECT year FROM main.payments
+           WHERE user_id = ? AND year < ?
+           GROUP BY year
+           HAVING SUM(CASE WHEN paid = 0 THEN 1 ELSE 0 END) = 0
+           ORDER BY year""",
+        (user_id, datetime.date.today().year)
+    )
+    years = [r[0] for r in cur.fetchall()]
+
+    if not years:
+        conn.close()
+        return []
+
+    cur.execute("PRAGMA main.table_info(payments)")
+    cols = ", ".join(row[1] for row in cur.fetchall())
+
+    for y in years:
+        cur.execute(
+            f"""INSERT INTO archive.payments ({cols})
+                SELECT {cols} FROM main.payments WHERE user_id = ? AND year = ?""",
+            (user_id, y)
+        )
+        cur.execute(
+            "DELETE FROM main.payments WHERE user_id = ? AND year = ?",
+            (user_id, y)
+        )
+        cur.execute(
+            """INSERT INTO archived_years (user_id, year, archived_at)
+               VALUES (?, ?, ?)
+               ON CONFLICT(user_id, year) DO NOTHING""",
+            (user_id, y, _now())
         )
+
+    _bump_version(cur, user_id)
+    conn.commit()
+    conn.close()
+    return years
+
+# -------------------- Alertas de orçamento --------------------
+ALERT_THRESHOLDS = (0.8, 1.0)
+
+def _crossed(before: float, after: float, limit: float):
+    """Percentuais de ALERT_THRESHOLDS do limite ultrapassados de before para after."""
+    if limit <= 0:
+        return []
+    return [t for t in ALERT_THRESHOLDS if before < t * limit <= after]
+
+def _apply_spend(cur, user_id: int, month: int, year: int, category_id, delta: float):
+    """
+    Atualiza o contador de gastos de (usuário, mês, categoria) e, se o gasto
+    cruzar 80%/100% da meta do mês ou do limite da categoria, registra um
+    alerta pendente. Usa apenas os contadores, sem reler as despesas do mês.
+    """
+    if not delta:
+        return
+    cat_key = category_id or 0
+
+    cur.execute(
+        """SELECT COALESCE(SUM(total), 0),
+                  COALESCE(SUM(CASE WHEN category_id = ? THEN total ELSE 0 END), 0)
+           FROM spend_counters
+           WHERE user_id = ? AND month = ? AND year = ?""",
+        (cat_key, user_id, month, year)
+    )
+    month_before, cat_before = (float(v) for v in cur.fetchone())
+
+    cur.execute(
+        """INSERT INTO spend_counters (user_id, month, year, category_id, total)
+           VALUES (?, ?, ?, ?, ?)
+           ON CONFLICT(user_id, year, month, category_id)
+           DO UPDATE SET total = spend_counters.total + excluded.total""",
+        (user_id, month, year, cat_key, delta)
+    )
+
+    if delta < 0:
+        return
+
+    alerts = []
+    cur.execute(
+        "SELECT expense_goal FROM budgets WHERE user_id = ? AND month = ? AND year = ?",
+        (user_id, month, year)
     )
+    row = cur.fetchone()
+    goal = float(row[0]) if row else 0.0
+    for t in _crossed(month_before, month_before + delta, goal):
+        alerts.append(f"Gastos de {month:02d}/{year} atingiram {t:.0%} da meta do mês.")
 
+    if cat_key:
+        cur.execute(
+            """SELECT l.limit_amount, c.name
+               FROM category_limits l
+               JOIN categories c ON c.id = l.category_id
+               WHERE l.user_id = ? AND l.category_id = ?""",
+            (user_id, cat_key)
+        )
+        row = cur.fetchone()
+        if row:
+            limit, name = float(row[0]), row[1]
+            for t in _crossed(cat_before, cat_before + delta, limit):
+                alerts.append(f"{name}: gastos de {month:02d}/{year} atingiram {t:.0%} do limite.")
+
+    for message in alerts:
+        cur.execute(
+            "INSERT INTO pending_alerts (user_id, message, created_at) VALUES (?, ?, ?)",
+            (user_id, message, _now())
+        )
+
+def pop_alerts(user_id: int):
+    """Retorna e remove os alertas pendentes do usuário (mais antigos primeiro)."""
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT id, message FROM pending_alerts WHERE user_id = ? ORDER BY id",
+        (user_id,)
+    )
+    rows = cur.fetchall()
+    if rows:
+        # relê com o lock: outro processo pode ter entregue os mesmos alertas
+        begin_write(conn)
+        cur.execute(
+            "SELECT id, message FROM pending_alerts WHERE user_id = ? ORDER BY id",
+            (user_id,)
+        )
+        rows = cur.fetchall()
+    if rows:
+        cur.execute(
+            "DELETE FROM pending_alerts WHERE user_id = ? AND id <= ?",
+            (user_id, rows[-1][0])
+        )
+        conn.commit()
+    conn.close()
+    return [message for _, message in rows]
+
+def list_category_limits(user_id: int):
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT category_id, limit_amount FROM category_limits WHERE user_id = ?",
+        (user_id,)
+    )
+    limits = {cid: float(limit) for cid, limit in cur.fetchall()}
+    conn.close()
+    return limits
+
+def set_category_limit(user_id: int, category_id: int, limit_amount: float):
+    """Define o limite mensal de gastos da categoria (0 remove o limite)."""
+    conn = get_write_connection()
+    cur = conn.cursor()
+    if limit_amount and limit_amount > 0:
+        cur.execute(
+            """INSERT INTO category_limits (user_id, category_id, limit_amount)
+               VALUES (?, ?, ?)
+               ON CONFLICT(user_id, category_id)
+               DO UPDATE SET limit_amount = excluded.limit_amount""",
+            (user_id, category_id, limit_amount)
+        )
+    else:
+        cur.execute(
+            "DELETE FROM category_limits WHERE user_id = ? AND category_id = ?",
+            (user_id, category_id)
+        )
+    _bump_version(cur, user_id)
+    conn.commit()
+    conn.close()
+
+# -------------------- Fila de escrita (pago / em aberto) --------------------
+class WriteBehindQueue:
+    """
+    Acumula as marcações de pago/em aberto de um usuário e grava todas numa
+    única transação quando flush() é chamado (a cada flush_interval segundos).
+    Cliques repetidos na mesma despesa são combinados: vale o último, e um
+    vai-e-volta que retorna ao estado original não gera escrita.
+    """
+
+    def __init__(self, user_id: int, flush_interval: float = 2.0):
+        self.user_id = user_id
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def mark_paid(self, payment_id: int, paid: bool, expected_version=None):
+        paid = bool(paid)
+        with self._lock:
+            if payment_id in self._pending:
+                _, version, original = self._pending[payment_id]
+                if paid == original:
+                    del self._pending[payment_id]
+                    return
+                self._pending[payment_id] = (paid, version, original)
+            else:
+                self._pending[payment_id] = (paid, expected_version, not paid)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def apply(self, rows):
+        """
+        Sobrepõe as marcações pendentes às linhas lidas do banco. A versão
+        exibida já é a que a linha terá depois do flush.
+        """
+        with self._lock:
+            pending = dict(self._pending)
+        if not pending:
+            return rows
+        out = []
+        for r in rows:
+            if r.id in pending:
+                paid, _, _ = pending[r.id]
+                r = r._replace(paid=int(paid), version=r.version + 1)
+            out.append(r)
+        return out
+
+    def due(self) -> bool:
+        return bool(self._pending) and time.monotonic() - self._last_flush >= self.flush_interval
+
+    def flush(self):
+        """Grava as marcações pendentes. Retorna os ids que deram conflito."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return []
+
+        conn = get_write_connection()
+        cur = conn.cursor()
+        conflicts = []
+        for payment_id, (paid, version, _) in pending.items():
+            if not _set_paid(cur, self.user_id, payment_id, paid, version) and version is not None:
+                conflicts.append(payment_id)
+        _bump_version(cur, self.user_id)
+        conn.commit()
+        conn.close()
+        return conflicts
+
+# -------------------- Fechamento de mês --------------------
+MONTH_CLOSED_MSG = "Mês fechado: reabra o mês para alterar as despesas."
+
+# Filtro usado nas escritas em lote: ignora linhas de meses fechados.
+_OPEN_MONTH_SQL = """NOT EXISTS (
+            SELECT 1 FROM month_snapshots s
+            WHERE s.user_id = payments.user_id
+              AND s.month = payments.month
+              AND s.year = payments.year
+        )"""
+
+def _closed_months_between(cur, user_id: int, month: int, year: int, n_months: int):
+    """Meses fechados entre (month, year) e os n_months - 1 seguintes."""
+    start = year * 12 + month - 1
+    cur.execute(
+        """SELECT month, year FROM month_snapshots
+           WHERE user_id = ? AND year * 12 + month - 1 BETWEEN ? AND ?""",
+        (user_id, start, start + max(n_months, 1) - 1)
+    )
+    return cur.fetchall()
+
+def _payment_month_closed(cur, user_id: int, payment_id: int) -> bool:
+    cur.execute(
+        """SELECT 1 FROM payments p
+           JOIN month_snapshots s
+             ON s.user_id = p.user_id AND s.month = p.month AND s.year = p.year
+           WHERE p.user_id = ? AND p.id = ?""",
+        (user_id, payment_id)
+    )
+    return cur.fetchone() is not None
+
+def get_month_snapshot(user_id: int, month: int, year: int):
+    """Snapshot do mês fechado ({"rows", "totals", "closed_at"}) ou None."""
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(
+        """SELECT rows_json, total, paid, closed_at FROM month_snapshots
+           WHERE user_id = ? AND month = ? AND year = ?""",
+        (user_id, month, year)
+    )
+    row = cur.fetchone()
+    conn.close()
+    if not row:
+        return None
+
+    data = json.loads(row[0])
+    fields = data["fields"]
+    rows = [
+        Payment._make(dict(zip(fields, values)).get(f) for f in Payment._fields)
+        for values in data["rows"]
+    ]
+    total, paid = float(row[1]), float(row[2])
+    return {
+        "rows": rows,
+        "totals": {"total": total, "paid": paid, "open": total - paid},
+        "closed_at": row[3],
+    }
+
+def is_month_closed(user_id: int, month: int, year: int) -> bool:
+    conn = get_connection()
+    closed = bool(_closed_months_between(conn.cursor(), user_id, month, year, 1))
+    conn.close()
+    return closed
+
+def close_month(user_id: int, month: int, year: int):
+    """
+    Fecha o mês: grava as despesas (com nome da categoria e valor em BRL)
+    e os totais num snapshot, servido para este mês até ele ser reaberto.
+    Enquanto fechado, as despesas do mês não aceitam alterações.
+    """
+    conn = get_connection()
+    # anexa o arquivo (se o ano foi arquivado) antes da transação; as
+    # despesas são lidas já com o lock, para o snapshot não perder escritas
+    _payments_table(conn, user_id, year)
+    begin_write(conn)
+    cur = conn.cursor()
+    if _closed_months_between(cur, user_id, month, year, 1):
+        conn.close()
+        raise ValueError("Mês já está fechado.")
+
+    _write_month_snapshot(conn, user_id, month, year, _now())
+    _bump_version(cur, user_id)
+    conn.commit()
+    conn.close()
+
+def _write_month_snapshot(conn, user_id: int, month: int, year: int, closed_at: str):
+    """Grava o snapshot do mês a partir das despesas atuais, na transação de conn."""
+    rows = _query_payments(conn, user_id, month, year)
+    totals = payment_totals(rows)
+    rows_json = json.dumps(
+        {"fields": list(Payment._fields), "rows": [list(r) for r in rows]},
+        ensure_ascii=False,
+        separators=(",", ":")
+    )
+    conn.cursor().execute(
+        """INSERT INTO month_snapshots (user_id, month, year, rows_json, total, paid, closed_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        (user_id, month, year, rows_json, totals["total"], totals["paid"], closed_at)
+    )
+
+def reopen_month(user_id: int, month: int, year: int):
+    conn = get_write_connection()
+    cur = conn.cursor()
+    cur.execute(
+        "DELETE FROM month_snapshots WHERE user_id = ? AND month = ? AND year = ?",
+        (user_id, month, year)
+    )
+    _bump_version(cur, user_id)
     conn.commit()
     conn.close()
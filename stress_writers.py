@@ -0,0 +1,115 @@
+import argparse
+import multiprocessing as mp
+import os
+import tempfile
+import time
+from datetime import date
+
+import database
+
+# Teste de estresse de escritores concorrentes no SQLite (vários processos
+# no mesmo database.db, como várias instâncias do Streamlit/API):
+#   python stress_writers.py [--procs 16] [--writes 200]
+#                            [--busy-timeout-ms 5000] [--retries 6]
+#
+# Cada processo faz --writes add_payment e, a cada três, um mark_paid na
+# última despesa. Ao final confere que nenhuma escrita se perdeu (linhas,
+# contadores de gastos e versão dos dados) e relata a vazão. Sai com erro
+# se houver perda ou exceção. Com --busy-timeout-ms baixo o caminho de
+# retentativa de begin_write é exercitado; --retries 0 mostra o que
+# acontece sem ele.
+USER_ID = 1
+
+
+def _configure(db_path, busy_timeout_ms, retries):
+    database.DB_PATH = db_path
+    database.DB_BUSY_TIMEOUT_MS = busy_timeout_ms
+    database.DB_WRITE_RETRIES = retries
+
+
+def _worker(args):
+    db_path, busy_timeout_ms, retries, index, n_writes = args
+    _configure(db_path, busy_timeout_ms, retries)
+    import repos
+
+    today = date.today()
+    added, marked, errors = 0, 0, []
+    for k in range(n_writes):
+        try:
+            ids = repos.add_payment(
+                USER_ID, f"p{index}-{k}", 1.0, today.isoformat(), today.month, today.year
+            )
+            added += 1
+            if k % 3 == 0 and repos.mark_paid(USER_ID, ids[0], True) is not None:
+                marked += 1
+        except Exception as e:
+            errors.append(str(e))
+    return added, marked, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Estresse de escritores concorrentes (SQLite)")
+    parser.add_argument("--procs", type=int, default=16)
+    parser.add_argument("--writes", type=int, default=200)
+    parser.add_argument("--busy-timeout-ms", type=int, default=database.DB_BUSY_TIMEOUT_MS)
+    parser.add_argument("--retries", type=int, default=database.DB_WRITE_RETRIES)
+    args = parser.parse_args(argv)
+
+    if database.is_postgres():
+        raise SystemExit("Este teste é para o backend SQLite (remova DATABASE_URL).")
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix="stress_writers_"), "database.db")
+    _configure(db_path, args.busy_timeout_ms, args.retries)
+    database.init_db()
+
+    import repos
+
+    t0 = time.perf_counter()
+    with mp.Pool(args.procs) as pool:
+        results = pool.map(
+            _worker,
+            [(db_path, args.busy_timeout_ms, args.retries, i, args.writes) for i in range(args.procs)]
+        )
+    elapsed = time.perf_counter() - t0
+
+    added = sum(r[0] for r in results)
+    marked = sum(r[1] for r in results)
+    errors = [e for r in results for e in r[2]]
+    expected = args.procs * args.writes
+
+    today = date.today()
+    rows = repos.list_payments(USER_ID, today.month, today.year)
+    totals = repos.month_totals(USER_ID, today.month, today.year)
+    conn = database.get_connection()
+    counter = conn.execute(
+        "SELECT COALESCE(SUM(total), 0) FROM spend_counters WHERE user_id = ?", (USER_ID,)
+    ).fetchone()[0]
+    conn.close()
+    version = repos.get_data_version(USER_ID)
+
+    print(f"{args.procs} processos x {args.writes} escritas "
+          f"(busy_timeout {args.busy_timeout_ms} ms, {args.retries} retentativas)")
+    print(f"  add_payment: {added}/{expected} ok, linhas gravadas: {len(rows)}")
+    print(f"  mark_paid:   {marked} ok, linhas pagas: {sum(1 for r in rows if r.paid)}")
+    print(f"  total do mês {totals['total']:.0f}, contadores {counter:.0f}, versão {version} "
+          f"(esperada {added + marked})")
+    print(f"  {elapsed:.2f} s, {added / elapsed:.0f} add_payment/s, "
+          f"{(added + marked) / elapsed:.0f} escritas/s")
+
+    lost = (
+        len(rows) != added
+        or sum(1 for r in rows if r.paid) != marked
+        or round(counter) != added
+        or version != added + marked
+    )
+    if errors:
+        print(f"  {len(errors)} erros, ex.: {errors[0]}")
+    if lost:
+        print("  FALHA: escritas perdidas ou contadores divergentes")
+    if errors or lost:
+        raise SystemExit(1)
+    print("  ok: nenhuma escrita perdida")
+
+
+if __name__ == "__main__":
+    main()